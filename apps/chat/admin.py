@@ -1,7 +1,8 @@
 from django.contrib import admin
 from django.utils.translation import ugettext as _
 
-from apps.chat.models import Room
+from apps.chat.announcements import send_announcement
+from apps.chat.models import Announcement, BannedWord, Room
 
 
 @admin.register(Room)
@@ -14,3 +15,27 @@ class RoomAdmin(admin.ModelAdmin):
     readonly_fields = ('id',)
     search_fields = ('id',)
     list_filter = ('staff_only',)
+
+
+@admin.register(BannedWord)
+class BannedWordAdmin(admin.ModelAdmin):
+    list_display = ('word', 'status')
+    search_fields = ('word',)
+    list_filter = ('status',)
+
+
+@admin.register(Announcement)
+class AnnouncementAdmin(admin.ModelAdmin):
+    list_display = ('message', 'created', 'sent', 'workers', 'delivered')
+    readonly_fields = ('created', 'sent', 'workers', 'delivered')
+    search_fields = ('message',)
+    actions = ('send',)
+
+    def send(self, request, queryset):
+        for announcement in queryset:
+            send_announcement(announcement)
+            self.message_user(request, _('"{}" delivered to {} connections on {} workers.').format(
+                announcement, announcement.delivered, announcement.workers
+            ))
+
+    send.short_description = _('Send to every connected user')
@@ -0,0 +1,95 @@
+import asyncio
+import json
+import time
+import uuid
+
+from django.conf import settings
+from django.utils import timezone
+from redis import StrictRedis
+
+from apps.chat.metrics import connections
+from apps.chat.protocol import encode_frame
+from apps.chat.pubsub import bus
+from apps.chat.utils import redis_sync_to_async
+from apps.repositories.interface import REDIS_API_SETTINGS
+
+# consumers served between yields to the event loop, so a large delivery doesn't stall other connections
+DELIVERY_BATCH = 1000
+
+
+class Announcer(object):
+    """
+    Alerts for every connected user.
+    One pub/sub message reaches every worker, each worker encodes the frame once and puts it
+    on the outbound queues of its local connections, then reports how many it served.
+    """
+    key = 'chat-announcement:{}'
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.redis = StrictRedis(**REDIS_API_SETTINGS)
+
+    def announce(self, message, wait=2):
+        """
+        Publish the alert and wait up to `wait` seconds for the workers' reports.
+        Returns workers reached by the publish, workers that reported and delivered frames.
+        """
+        announcement_id = str(uuid.uuid4())
+        key = self.key.format(announcement_id)
+        workers = bus.publish(self.channel, json.dumps({'id': announcement_id, 'message': message}))
+        deadline = time.monotonic() + wait
+        report = {}
+
+        while time.monotonic() < deadline:
+            report = self.redis.hgetall(key)
+
+            if int(report.get('workers', 0)) >= workers:
+                break
+
+            time.sleep(0.1)
+
+        return workers, int(report.get('workers', 0)), int(report.get('delivered', 0))
+
+    def schedule(self, message):
+        """
+        Pub/sub handler, delivery runs in its own task so the listener isn't held up by it.
+        """
+        asyncio.ensure_future(self.deliver(message))
+
+    async def deliver(self, message):
+        """
+        Send the alert to every local connection.
+        """
+        announcement = json.loads(message)
+        event = encode_frame({'msg_type': settings.MSG_TYPE_ALERT, 'message': announcement['message']})
+        delivered = 0
+
+        for consumer in list(connections.connections):
+            consumer.outbound.put(event[consumer.frame])
+            delivered += 1
+
+            if not delivered % DELIVERY_BATCH:
+                await asyncio.sleep(0)
+
+        await redis_sync_to_async(self.report)(announcement['id'], delivered)
+
+    def report(self, announcement_id, delivered):
+        key = self.key.format(announcement_id)
+        pipe = self.redis.pipeline()
+        pipe.hincrby(key, 'workers', 1)
+        pipe.hincrby(key, 'delivered', delivered)
+        pipe.expire(key, 60 * 60)
+        pipe.execute()
+
+
+announcer = Announcer(settings.ANNOUNCEMENT_CHANNEL)
+
+
+def send_announcement(announcement, wait=2):
+    """
+    Send the Announcement to every connected user and store the delivery report.
+    """
+    _, announcement.workers, announcement.delivered = announcer.announce(announcement.message, wait)
+    announcement.sent = timezone.now()
+    announcement.save(update_fields=('sent', 'workers', 'delivered'))
+    return announcement
@@ -0,0 +1,109 @@
+import asyncio
+import atexit
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from apps.chat.stream import message_stream
+from apps.chat.tasks import MessageSaver
+
+logger = logging.getLogger(__name__)
+
+
+def celery_sink(rows):
+    MessageSaver.save_message.delay(rows)
+
+
+def stream_sink(rows):
+    message_stream.append(rows)
+
+
+MESSAGE_SINKS = {
+    'celery': celery_sink,
+    'stream': stream_sink,
+}
+
+
+class MessageBuffer(object):
+    """
+    Write-behind buffer for chat messages.
+    Accumulates rows per worker and hands them to the sink in batches, when either
+    `flush_size` rows are waiting or `flush_interval` seconds passed since the first one.
+    Memory is bounded by `max_size`, the oldest rows are dropped when the sink can't keep up.
+    """
+
+    def __init__(self, sink, flush_size, flush_interval, max_size):
+        self.sink = sink
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.rows = deque(maxlen=max_size)
+        self.dropped = 0
+        self.flushed = 0
+        self._timer = None
+        self._pending = False
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def append(self, row):
+        """
+        Add row to the buffer and schedule a flush. Must be called from the event loop.
+        """
+        if len(self.rows) == self.rows.maxlen:
+            self.dropped += 1
+
+        self.rows.append(row)
+
+        if len(self.rows) >= self.flush_size:
+            self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_event_loop().call_later(self.flush_interval, self.flush)
+
+    def flush(self):
+        """
+        Drain the buffer in the background thread, so the event loop never waits for the broker.
+        At most one drain waits in the executor, it takes every row appended before it starts.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        if not self._pending:
+            self._pending = True
+            self._executor.submit(self.drain)
+
+    def drain(self):
+        """
+        Send everything buffered so far, one sink call per `flush_size` rows.
+        """
+        # cleared before reading, so rows appended from now on schedule the next drain
+        self._pending = False
+
+        while self.rows:
+            batch = []
+
+            while self.rows and len(batch) < self.flush_size:
+                batch.append(self.rows.popleft())
+
+            try:
+                self.sink(batch)
+                self.flushed += len(batch)
+            except Exception:
+                self.dropped += len(batch)
+                logger.exception('Unable to flush %d messages', len(batch))
+
+    def shutdown(self):
+        """
+        Flush remaining rows synchronously, called on interpreter exit.
+        """
+        self._executor.shutdown(wait=True)
+        self.drain()
+
+
+message_buffer = MessageBuffer(
+    MESSAGE_SINKS[settings.MESSAGE_PERSISTENCE],
+    settings.MESSAGE_BUFFER_FLUSH_SIZE,
+    settings.MESSAGE_BUFFER_FLUSH_INTERVAL,
+    settings.MESSAGE_BUFFER_MAX_SIZE,
+)
+atexit.register(message_buffer.shutdown)
@@ -0,0 +1,101 @@
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+from django.conf import settings
+
+from apps.chat.pubsub import bus
+
+
+class CachedRoom(NamedTuple):
+    id: str
+    staff_only: bool
+    group_name: str
+
+
+class LRUCache(object):
+    """
+    Per-process LRU cache with TTL, used for room metadata and websocket users.
+    """
+
+    def __init__(self, max_size, timeout):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items = OrderedDict()
+
+    def get(self, key):
+        """
+        Return cached value or None if it is missing or expired.
+        """
+        entry = self._items.get(key)
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        value, expires = entry
+
+        if expires < time.monotonic():
+            del self._items[key]
+            self.misses += 1
+            return None
+
+        self._items.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, generation=None):
+        """
+        Put value into the cache.
+        Skipped if an invalidation happened since `generation` was read, so stale rows never get back in.
+        """
+        if generation is not None and generation != self.generation:
+            return
+
+        self._items[key] = (value, time.monotonic() + self.timeout)
+        self._items.move_to_end(key)
+
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        """
+        Drop value from the cache.
+        """
+        self.generation += 1
+        self._items.pop(key, None)
+
+    def clear(self):
+        self.generation += 1
+        self._items.clear()
+
+    def stats(self):
+        return {
+            'size': len(self._items),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+room_cache = LRUCache(settings.ROOM_CACHE_MAX_SIZE, settings.ROOM_CACHE_TIMEOUT)
+
+# search results and the ids of staff only rooms hidden from other users' searches
+search_cache = LRUCache(settings.SEARCH_CACHE_MAX_SIZE, settings.SEARCH_CACHE_TIMEOUT)
+STAFF_ROOMS_KEY = 'staff-rooms'
+
+
+def invalidate_room(room_uuid):
+    room_cache.invalidate(room_uuid)
+    search_cache.invalidate(STAFF_ROOMS_KEY)
+
+
+bus.register(settings.ROOM_CACHE_INVALIDATION_CHANNEL, invalidate_room)
+
+user_cache = LRUCache(settings.WEBSOCKET_USER_CACHE_MAX_SIZE, settings.WEBSOCKET_USER_CACHE_TIMEOUT)
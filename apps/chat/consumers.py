@@ -1,8 +1,66 @@
+import asyncio
+import logging
+import time
+import uuid
+
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
 from django.conf import settings
+from django.utils import timezone
+from elasticsearch import ElasticsearchException
 
+from apps.chat.announcements import announcer
 from apps.chat.exceptions import ClientError
-from apps.chat.utils import get_room_or_error
+from apps.chat.fanout import broadcast, fanout
+from apps.chat.metrics import (
+    COMMAND_ERRORS, COMMAND_SECONDS, GROUP_ADD_SECONDS, MODERATED, connections, send_json_seconds
+)
+from apps.chat.moderation import moderation
+from apps.chat.middleware import TOKEN_SUBPROTOCOL
+from apps.chat.outbound import OutboundQueue
+from apps.chat.presence import presence, presence_store
+from apps.chat.protocol import MSGPACK_SUBPROTOCOL, decode_msgpack, encode_frame, encode_msgpack
+from apps.chat.sanctions import BAN, MUTE, sanctions
+from apps.chat.search import search_messages_async
+from apps.chat.serializers import HistorySerializer, MessageSearchSerializer
+from apps.chat.throttling import send_throttle
+from apps.chat.pubsub import bus
+from apps.chat.utils import get_room_or_error, get_rooms_or_error, normalize_uuid, redis_sync_to_async
+from apps.repositories.elasticsearch_interface import AsyncElasticInterface
+from apps.repositories.redis_interface import RedisInterface
+
+logger = logging.getLogger(__name__)
+
+elastic = AsyncElasticInterface()
+recent = RedisInterface()
+
+# workers serving websockets deliver staff alerts to their connections
+bus.register(settings.ANNOUNCEMENT_CHANNEL, announcer.schedule)
+
+
+def check_room_count(room_uuids):
+    """
+    join_many and leave_many take a list of at most JOIN_MANY_MAX_ROOMS rooms.
+    """
+    if not isinstance(room_uuids, list):
+        raise ClientError('ROOMS_INVALID')
+
+    if len(room_uuids) > settings.JOIN_MANY_MAX_ROOMS:
+        raise ClientError('TOO_MANY_ROOMS', max=settings.JOIN_MANY_MAX_ROOMS)
+
+
+def parse_seq(value):
+    """
+    Sequence number sent by the client, a non-negative integer.
+    """
+    try:
+        seq = int(value)
+    except (TypeError, ValueError):
+        raise ClientError('SEQ_INVALID')
+
+    if seq < 0:
+        raise ClientError('SEQ_INVALID')
+
+    return seq
 
 
 class ChatConsumer(AsyncJsonWebsocketConsumer):
@@ -13,13 +71,52 @@ class ChatConsumer(AsyncJsonWebsocketConsumer):
     async def connect(self):
         """
         Called when the websocket is handshaking as part of initial connection.
+        Clients offering the `chatter.msgpack` subprotocol get binary msgpack frames, JSON text otherwise.
         """
+        bus.start()
+        presence.start()
+
+        subprotocols = self.scope.get('subprotocols', [])
+        self.binary = MSGPACK_SUBPROTOCOL in subprotocols
+        self.frame = 'bytes' if self.binary else 'text'
+
         if self.scope['user'].is_anonymous:
             await self.close()
+        elif self.binary:
+            await self.accept_subprotocol(MSGPACK_SUBPROTOCOL)
+        elif TOKEN_SUBPROTOCOL in subprotocols:
+            await self.accept_subprotocol(TOKEN_SUBPROTOCOL)
         else:
             await self.accept()
 
-        self.rooms = set()
+        # joined rooms by id, kept so leaving never depends on the room still being accessible
+        self.rooms = {}
+        self.send_tokens = {}
+        self.throttled_until = {}
+        self.outbound = OutboundQueue(
+            self.send,
+            self.close,
+            settings.OUTBOUND_QUEUE_SIZE,
+            settings.OUTBOUND_QUEUE_POLICY,
+            settings.OUTBOUND_QUEUE_MAX_LAG,
+        )
+        self.outbound.start()
+        connections.connections.add(self)
+
+    async def accept_subprotocol(self, subprotocol):
+        """
+        Accept the handshake choosing one of the offered subprotocols, accept() of channels 2.0 takes none.
+        """
+        await self.base_send({'type': 'websocket.accept', 'subprotocol': subprotocol})
+
+    async def receive(self, text_data=None, bytes_data=None, **kwargs):
+        """
+        Binary frames of msgpack clients are decoded here, text frames are left to the JSON consumer.
+        """
+        if bytes_data is not None and self.binary:
+            await self.receive_json(decode_msgpack(bytes_data), **kwargs)
+        else:
+            await super().receive(text_data, bytes_data, **kwargs)
 
     async def receive_json(self, content):
         """
@@ -27,128 +124,375 @@ class ChatConsumer(AsyncJsonWebsocketConsumer):
         for us and pass it as the first argument.
         """
         command = content.get('command', None)
-        
+        timer = COMMAND_SECONDS.get(str(command), COMMAND_SECONDS['unknown'])
+        start = time.perf_counter()
+
         try:
             if command == 'join':
-                await self.join_room(content['room'])
+                await self.join_room(content['room'], content.get('last_seen_seq'))
             elif command == 'leave':
                 await self.leave_room(content['room'])
+            elif command == 'join_many':
+                await self.join_rooms(content['rooms'])
+            elif command == 'leave_many':
+                await self.leave_rooms(content['rooms'])
             elif command == 'send':
                 await self.send_room(content['room'], content['message'])
+            elif command == 'history':
+                await self.room_history(content['room'], content)
+            elif command == 'heartbeat':
+                await presence.heartbeat(self.scope['user'].username)
+            elif command == 'who':
+                await self.room_who(content['room'])
+            elif command == 'search':
+                await self.search(content)
         except ClientError as e:
-            await self.send_json({'error': e.code})
+            COMMAND_ERRORS.get(str(command), COMMAND_ERRORS['unknown']).inc()
+            await self.send_json(dict(e.details, error=e.code))
+        finally:
+            timer.observe(time.perf_counter() - start)
+
+    async def send_json(self, content, close=False):
+        """
+        Encode and send a direct reply in the negotiated protocol, timed for the metrics.
+        """
+        start = time.perf_counter()
+
+        if self.binary:
+            await self.send(bytes_data=encode_msgpack(content), close=close)
+        else:
+            await super().send_json(content, close)
+
+        send_json_seconds.observe(time.perf_counter() - start)
 
     async def disconnect(self, code):
         """
         Called when the WebSocket closes for any reason.
         """
-        for room_uuid in list(self.rooms):
-            try:
-                await self.leave_room(room_uuid)
-            except ClientError:
-                pass
+        if self.rooms:
+            await self.leave(list(self.rooms.values()))
 
-    async def join_room(self, room_uuid):
+        self.outbound.stop()
+        connections.connections.discard(self)
+
+    async def join_room(self, room_uuid, last_seen_seq=None):
         """
         Called by receive_json when someone sent a join command.
+        On reconnect client passes `last_seen_seq` and gets only the messages it missed.
         """
+        if last_seen_seq is not None:
+            last_seen_seq = parse_seq(last_seen_seq)
+
         room = await get_room_or_error(room_uuid, self.scope['user'])
+        await sanctions.ready()
 
-        if settings.NOTIFY_USERS_ON_ENTER_OR_LEAVE_ROOMS:
-            await self.channel_layer.group_send(
-                room.group_name,
-                {
-                    'type': 'chat.join',
-                    'room_uuid': room_uuid,
-                    'username': self.scope['user'].username,
-                }
-            )
+        if sanctions.get(BAN, room.id, self.scope['user'].pk) is not None:
+            raise ClientError('USER_BANNED', room=room.id)
 
-        self.rooms.add(room_uuid)
+        if room.id not in self.rooms:
+            await presence.join([room], self.scope['user'].username)
+            self.rooms[room.id] = room
 
-        await self.channel_layer.group_add(
-            room.group_name,
-            self.channel_name,
-        )
+        await self.group_join(room.group_name)
 
-        await self.send_json({'join': str(room.id)})
+        if last_seen_seq is None:
+            messages = await redis_sync_to_async(recent.get_messages)(room.id, settings.JOIN_HISTORY_LIMIT)
+            await self.send_json({'join': str(room.id), 'messages': messages})
+        else:
+            messages, truncated = await self.replay(room, last_seen_seq)
+            await self.send_json({'join': str(room.id), 'messages': messages, 'truncated': truncated})
+
+    async def replay(self, room, last_seen_seq):
+        """
+        Messages of the room newer than `last_seen_seq`, the part which left the redis log is read from elastic.
+        `truncated` means the gap is longer than REPLAY_LIMIT, elastic is unavailable or doesn't have
+        the whole gap yet (messages reach it through the buffer and the indexer), and client has to refresh the history.
+        """
+        messages, complete, last_seq = await redis_sync_to_async(recent.get_messages_since)(room.id, last_seen_seq)
+
+        if complete:
+            return messages, False
+
+        until = messages[0]['seq'] if messages else last_seq + 1
+
+        try:
+            older = await elastic.get_messages_since(room.id, last_seen_seq, settings.REPLAY_LIMIT, until)
+        except (asyncio.TimeoutError, ElasticsearchException):
+            logger.exception('Unable to replay room %s from elasticsearch', room.id)
+            return messages, True
+
+        contiguous = [message.get('seq') for message in older] == list(range(last_seen_seq + 1, until))
+        return older + messages, not contiguous
 
     async def leave_room(self, room_uuid):
         """
         Called by receive_json when someone sent a leave command.
         """
-        room = await get_room_or_error(room_uuid, self.scope['user'])
+        room = self.rooms.get(normalize_uuid(room_uuid))
 
-        if settings.NOTIFY_USERS_ON_ENTER_OR_LEAVE_ROOMS:
-            await self.channel_layer.group_send(
-                room.group_name,
-                {
-                    'type': 'chat.leave',
-                    'room_uuid': room_uuid,
-                    'username': self.scope['user'].username,
-                }
-            )
+        if room is None:
+            room = await get_room_or_error(room_uuid, self.scope['user'])
+        else:
+            await self.leave([room])
 
-        self.rooms.discard(room_uuid)
+        await self.send_json({'leave': str(room.id)})
 
-        await self.channel_layer.group_discard(
-            room.group_name,
-            self.channel_name,
-        )
+    async def join_rooms(self, room_uuids):
+        """
+        Called by receive_json when someone sent a join_many command, usually after reconnect.
+        All rooms are resolved with one query and group memberships are added concurrently.
+        """
+        check_room_count(room_uuids)
+        rooms, errors = await get_rooms_or_error(room_uuids, self.scope['user'])
+        await sanctions.ready()
 
-        await self.send_json({'leave': str(room.id)})
+        for room_uuid, room in list(rooms.items()):
+            if sanctions.get(BAN, room.id, self.scope['user'].pk) is not None:
+                del rooms[room_uuid]
+                errors[room_uuid] = 'USER_BANNED'
+
+        # rejoining a room must not count the connection twice, it leaves only once
+        joined = {room.id: room for room in rooms.values() if room.id not in self.rooms}
+        await presence.join(list(joined.values()), self.scope['user'].username)
+
+        self.rooms.update(joined)
+
+        await asyncio.gather(*[self.group_join(room.group_name) for room in rooms.values()])
+        await self.send_json({'join_many': [room.id for room in rooms.values()], 'errors': errors})
+
+    async def leave_rooms(self, room_uuids):
+        """
+        Called by receive_json when someone sent a leave_many command.
+        Joined rooms are left without checking access, only the rest is resolved for the errors.
+        """
+        check_room_count(room_uuids)
+        rooms = {}
+        others = []
+
+        for room_uuid in map(str, room_uuids):
+            try:
+                room = self.rooms.get(normalize_uuid(room_uuid))
+            except ClientError:
+                room = None
+
+            if room is None:
+                others.append(room_uuid)
+            else:
+                rooms[room.id] = room
+
+        errors = {}
+
+        if others:
+            resolved, errors = await get_rooms_or_error(others, self.scope['user'])
+            rooms.update((room.id, room) for room in resolved.values())
+
+        await self.leave([room for room in rooms.values() if room.id in self.rooms])
+        await self.send_json({'leave_many': list(rooms), 'errors': errors})
+
+    async def leave(self, rooms):
+        """
+        Leave joined rooms: presence, group membership and the local set.
+        """
+        await presence.leave(rooms, self.scope['user'].username)
+
+        for room in rooms:
+            self.rooms.pop(room.id, None)
+
+        await asyncio.gather(*[self.group_leave(room.group_name) for room in rooms])
 
     async def send_room(self, room_uuid, message):
         """
         Called by receive_json when someone sends a message to a room.
         """
-        if room_uuid not in self.rooms:
+        if normalize_uuid(room_uuid) not in self.rooms:
             raise ClientError('ROOM_ACCESS_DENIED')
 
         room = await get_room_or_error(room_uuid, self.scope['user'])
-        await self.channel_layer.group_send(
+
+        if await self.muted(room_uuid, room):
+            return
+
+        await self.throttle(room)
+
+        if await self.moderate(room_uuid, room, message):
+            return
+
+        created = timezone.now().isoformat()
+        message_uuid = str(uuid.uuid4())
+        seq = await redis_sync_to_async(recent.append_message)(
+            room=room.id,
+            user=self.scope['user'],
+            created=created,
+            message=message,
+            status=settings.MSG_TYPE_MESSAGE,
+            tags=[],
+            uuid=message_uuid
+        )
+        await broadcast(
             room.group_name,
-            {
-                'type': 'chat.message',
-                'room_uuid': room_uuid,
-                'username': self.scope['user'].username,
-                'message': message,
-            }
+            dict(
+                type='chat.message',
+                **encode_frame({
+                    'msg_type': settings.MSG_TYPE_MESSAGE,
+                    'room': room_uuid,
+                    'username': self.scope['user'].username,
+                    'message': message,
+                    'seq': seq,
+                })
+            )
+        )
+        await elastic.append_message(
+            room=room.id,
+            user=self.scope['user'],
+            created=created,
+            message=message,
+            status=settings.MSG_TYPE_MESSAGE,
+            tags=[],
+            uuid=message_uuid,
+            seq=seq
         )
 
-    async def chat_join(self, event):
+    async def throttle(self, room):
         """
-        Called when someone has joined our chat.
+        Charge one send to the user and room token buckets.
+        Tokens are leased from redis in batches of SEND_RATE_LEASE and spent locally, so well-behaved clients
+        rarely cause a redis call, and a throttled client is rejected locally until its retry time.
         """
-        await self.send_json(
-            {
-                'msg_type': settings.MSG_TYPE_ENTER,
-                'room': event['room_uuid'],
-                'username': event['username'],
-            },
-        )
+        now = time.monotonic()
+
+        if self.throttled_until.get(room.id, 0) > now:
+            raise ClientError('RATE_LIMITED', retry_after=round(self.throttled_until[room.id] - now, 3))
+
+        tokens = self.send_tokens.get(room.id, 0)
+
+        if not tokens:
+            tokens, retry_after = await redis_sync_to_async(send_throttle.acquire)(
+                self.scope['user'].pk, room.id, settings.SEND_RATE_LEASE
+            )
 
-    async def chat_leave(self, event):
+            if not tokens:
+                self.throttled_until[room.id] = now + retry_after
+                raise ClientError('RATE_LIMITED', retry_after=round(retry_after, 3))
+
+        self.send_tokens[room.id] = tokens - 1
+
+    async def muted(self, room_uuid, room):
         """
-        Called when someone has left our chat.
+        Muted and banned users can't send, they get a MUTED frame with the time the sanction ends (0 - never).
         """
-        await self.send_json(
-            {
-                'msg_type': settings.MSG_TYPE_LEAVE,
-                'room': event['room_uuid'],
-                'username': event['username'],
-            },
-        )
+        await sanctions.ready()
+        user_id = self.scope['user'].pk
+        until = sanctions.get(MUTE, room.id, user_id)
+
+        if until is None:
+            until = sanctions.get(BAN, room.id, user_id)
+
+        if until is None:
+            return False
+
+        await self.send_json({'msg_type': settings.MSG_TYPE_MUTED, 'room': room_uuid, 'until': until})
+        return True
+
+    async def moderate(self, room_uuid, room, message):
+        """
+        Scan the message for banned words. A message containing any is not delivered,
+        the author gets a WARNING or MUTED frame with the words found, MUTED words also mute the author in the room.
+        """
+        await moderation.ready()
+        status, words = moderation.scan(message)
+
+        if status is None:
+            return False
+
+        MODERATED[status].inc()
+        frame = {'msg_type': status, 'room': room_uuid, 'words': words}
+
+        if status == settings.MSG_TYPE_MUTED:
+            frame['until'] = await redis_sync_to_async(sanctions.add)(
+                MUTE, room.id, self.scope['user'].pk, settings.MODERATION_MUTE_DURATION
+            )
+
+        await self.send_json(frame)
+        return True
+
+    async def room_who(self, room_uuid):
+        """
+        Called by receive_json when someone asks who is online in a room.
+        """
+        room = await get_room_or_error(room_uuid, self.scope['user'])
+        users = await redis_sync_to_async(presence_store.online)(room.id)
+        await self.send_json({'who': str(room.id), 'users': users})
+
+    async def room_history(self, room_uuid, content):
+        """
+        Called by receive_json when someone asks for older messages of a room.
+        Cursor is `created` and `uuid` of the oldest message the client has.
+        """
+        room = await get_room_or_error(room_uuid, self.scope['user'])
+        serializer = HistorySerializer(data=content)
+
+        if not serializer.is_valid():
+            raise ClientError('HISTORY_INVALID', errors=serializer.errors)
+
+        limit = serializer.validated_data.get('limit') or settings.HISTORY_PAGE_SIZE
+        cursor = serializer.validated_data.get('cursor')
+
+        try:
+            messages = await elastic.get_messages(room.id, limit, cursor)
+        except (asyncio.TimeoutError, ElasticsearchException):
+            logger.exception('Unable to load history of room %s', room.id)
+            raise ClientError('HISTORY_UNAVAILABLE', room=room.id)
+
+        if len(messages) == limit:
+            cursor = {'created': messages[0]['created'], 'uuid': messages[0]['uuid']}
+        else:
+            cursor = None
+
+        await self.send_json({'history': str(room.id), 'messages': messages, 'cursor': cursor})
+
+    async def search(self, content):
+        """
+        Called by receive_json when someone searches messages, takes the parameters of the REST search endpoint.
+        """
+        serializer = MessageSearchSerializer(data=content)
+
+        if not serializer.is_valid():
+            raise ClientError('SEARCH_INVALID', errors=serializer.errors)
+
+        try:
+            result = await search_messages_async(elastic, self.scope['user'], serializer.validated_data)
+        except (asyncio.TimeoutError, ElasticsearchException):
+            logger.exception('Unable to search messages')
+            raise ClientError('SEARCH_UNAVAILABLE')
+
+        await self.send_json({'search': content.get('q', ''), **result})
+
+    async def group_join(self, group_name):
+        start = time.perf_counter()
+
+        if settings.CHAT_FANOUT == 'local':
+            await fanout.add(group_name, self)
+        else:
+            await self.channel_layer.group_add(group_name, self.channel_name)
+
+        GROUP_ADD_SECONDS[settings.CHAT_FANOUT].observe(time.perf_counter() - start)
+
+    async def group_leave(self, group_name):
+        if settings.CHAT_FANOUT == 'local':
+            await fanout.remove(group_name, self)
+        else:
+            await self.channel_layer.group_discard(group_name, self.channel_name)
+
+    async def chat_presence(self, event):
+        """
+        Called with the users who joined or left our chat during the last aggregation window.
+        Frame is encoded once by the sender and forwarded as is through the outbound queue.
+        """
+        self.outbound.put(event[self.frame])
 
     async def chat_message(self, event):
         """
         Called when someone has messaged our chat.
+        Frame is encoded once by the sender and forwarded as is through the outbound queue.
         """
-        await self.send_json(
-            {
-                'msg_type': settings.MSG_TYPE_MESSAGE,
-                'room': event['room_uuid'],
-                'username': event['username'],
-                'message': event['message'],
-            },
-        )
+        self.outbound.put(event[self.frame])
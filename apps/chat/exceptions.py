@@ -2,6 +2,7 @@ class ClientError(Exception):
     """
     Custom exception for the websocket receive().
     """
-    def __init__(self, code):
+    def __init__(self, code, **details):
         super().__init__(code)
         self.code = code
+        self.details = details
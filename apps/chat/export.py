@@ -0,0 +1,120 @@
+import json
+import os
+import zlib
+
+import zstandard
+from elasticsearch import Elasticsearch
+
+from apps.repositories.interface import ELASTICSEARCH_API_SETTINGS
+from apps.repositories.search import INDEX_ALIAS
+
+EXTENSIONS = {
+    'gzip': 'gz',
+    'zstd': 'zst',
+}
+
+# only the scroll id and the documents, elasticsearch skips the rest of every response
+FILTER_PATH = ['_scroll_id', 'hits.hits._source']
+SCROLL = '5m'
+
+
+class NDJSONWriter(object):
+    """
+    Writes pages of rows as compressed NDJSON, starts a new file when the current one reaches `max_bytes` on disk.
+    Both compressors are used through compressobj, so compressed bytes go straight to the file.
+    """
+
+    def __init__(self, directory, prefix, compression, max_bytes):
+        self.directory = directory
+        self.prefix = prefix
+        self.compression = compression
+        self.max_bytes = max_bytes
+        self.files = []
+        self.raw = None
+        self.compressor = None
+
+    def open(self):
+        path = os.path.join(self.directory, '{}-{:04d}.ndjson.{}'.format(
+            self.prefix, len(self.files), EXTENSIONS[self.compression]
+        ))
+        self.raw = open(path, 'wb')
+
+        if self.compression == 'zstd':
+            self.compressor = zstandard.ZstdCompressor(level=3).compressobj()
+        else:
+            # wbits 31 - gzip header and trailer
+            self.compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+
+        self.files.append(path)
+
+    def write(self, rows):
+        if self.compressor is None:
+            self.open()
+
+        lines = ''.join(json.dumps(row, separators=(',', ':')) + '\n' for row in rows)
+        self.raw.write(self.compressor.compress(lines.encode('utf8')))
+
+        # compressors buffer internally, so the file may run over by up to one page
+        if self.raw.tell() >= self.max_bytes:
+            self.close()
+
+    def close(self):
+        if self.compressor is None:
+            return
+
+        self.raw.write(self.compressor.flush())
+        self.raw.close()
+        self.compressor = None
+        self.raw = None
+
+
+def export_query(room=None, since=None, until=None):
+    filters = []
+
+    if room:
+        filters.append({'term': {'room': room}})
+
+    if since or until:
+        dates = {key: value for key, value in (('gte', since), ('lt', until)) if value}
+        filters.append({'range': {'created': dates}})
+
+    return {'bool': {'filter': filters}}
+
+
+def export_slice(slice_id, slices, directory, compression, max_bytes, batch_size, room=None, since=None, until=None):
+    """
+    Export one slice of the scroll into its own files, runs in a worker process with its own client.
+    Only the current page is held in memory. Returns exported rows and written files.
+    Pages are filtered by FILTER_PATH, which leaves out `hits` entirely when a page is empty.
+    """
+    es = Elasticsearch(**ELASTICSEARCH_API_SETTINGS)
+    body = {'query': export_query(room, since, until), 'sort': ['_doc']}
+
+    if slices > 1:
+        body['slice'] = {'id': slice_id, 'max': slices}
+
+    writer = NDJSONWriter(directory, 'messages-{:03d}'.format(slice_id), compression, max_bytes)
+    response = es.search(
+        index=INDEX_ALIAS, body=body, scroll=SCROLL, size=batch_size, routing=room, filter_path=FILTER_PATH
+    )
+    scroll_id = response.get('_scroll_id')
+    rows = 0
+
+    try:
+        while True:
+            hits = response.get('hits', {}).get('hits', [])
+
+            if not hits:
+                break
+
+            writer.write(hit['_source'] for hit in hits)
+            rows += len(hits)
+            response = es.scroll(scroll_id=scroll_id, scroll=SCROLL, filter_path=FILTER_PATH)
+            scroll_id = response.get('_scroll_id', scroll_id)
+    finally:
+        writer.close()
+
+        if scroll_id:
+            es.clear_scroll(scroll_id=scroll_id, ignore=(404,))
+
+    return rows, writer.files
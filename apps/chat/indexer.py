@@ -0,0 +1,211 @@
+import datetime
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from elasticsearch.helpers import streaming_bulk
+from elasticsearch_dsl.connections import connections
+from redis import StrictRedis
+
+from apps.repositories.interface import REDIS_API_SETTINGS
+from apps.repositories.search import MessageIndex
+
+logger = logging.getLogger(__name__)
+
+_template_lock = threading.Lock()
+_template_ready = False
+
+
+def ensure_template(es):
+    """
+    Install the index template once per worker process instead of once per batch.
+    """
+    global _template_ready
+
+    with _template_lock:
+        if not _template_ready:
+            MessageIndex.init_template(es)
+            _template_ready = True
+
+
+def is_transient(item):
+    """
+    Rejections worth retrying later: queue full after all backoff retries, server and connection errors.
+    Anything else (mapping errors, malformed documents) fails the same way every time.
+    """
+    status = next(iter(item.values())).get('status')
+    return not isinstance(status, int) or status == 429 or status >= 500
+
+
+class DeadLetters(object):
+    """
+    Redis list of documents elasticsearch rejected for good, kept for inspection and replay.
+    """
+    key = 'chat-dead-letters'
+
+    def __init__(self):
+        self.redis = StrictRedis(**REDIS_API_SETTINGS)
+
+    def push(self, failures):
+        failed_at = datetime.datetime.utcnow().isoformat()
+        self.redis.rpush(self.key, *[
+            json.dumps({'row': row, 'error': str(error), 'failed_at': failed_at}) for row, error in failures
+        ])
+
+    def pop(self, count):
+        pipe = self.redis.pipeline()
+        pipe.lrange(self.key, 0, count - 1)
+        pipe.ltrim(self.key, count, -1)
+        return [json.loads(letter)['row'] for letter in pipe.execute()[0]]
+
+    def __len__(self):
+        return self.redis.llen(self.key)
+
+
+dead_letters = DeadLetters()
+
+
+class BulkIndexer(object):
+    """
+    Saves message rows to the MessageIndex.
+    Rows are split into chunks indexed by `threads` parallel streaming_bulk calls. Rejections with 429
+    are retried by streaming_bulk with exponential backoff, permanent failures go to the dead letters.
+    """
+
+    def __init__(self, es=None, chunk_size=None, threads=None, max_retries=None, initial_backoff=None,
+                 max_backoff=None):
+        self.es = es or connections.get_connection()
+        self.chunk_size = chunk_size or settings.INDEXER_CHUNK_SIZE
+        self.threads = threads or settings.INDEXER_THREADS
+        self.max_retries = settings.INDEXER_MAX_RETRIES if max_retries is None else max_retries
+        self.initial_backoff = initial_backoff or settings.INDEXER_INITIAL_BACKOFF
+        self.max_backoff = max_backoff or settings.INDEXER_MAX_BACKOFF
+        self.executor = ThreadPoolExecutor(max_workers=self.threads) if self.threads > 1 else None
+
+    def index(self, rows):
+        """
+        Index rows, returns indexes of rows which failed for a transient reason and have to be retried.
+        """
+        ensure_template(self.es)
+        chunks = [
+            range(start, min(start + self.chunk_size, len(rows))) for start in range(0, len(rows), self.chunk_size)
+        ]
+
+        if self.executor is None:
+            results = [self.index_chunk(rows, chunk) for chunk in chunks]
+        else:
+            results = list(self.executor.map(lambda chunk: self.index_chunk(rows, chunk), chunks))
+
+        retry = [index for transient, _ in results for index in transient]
+        failed = [failure for _, permanent in results for failure in permanent]
+
+        if failed:
+            logger.error('%d messages rejected, moved to dead letters', len(failed))
+            dead_letters.push(failed)
+
+        return retry
+
+    def index_chunk(self, rows, chunk):
+        """
+        Index one chunk. Results of retried documents come out of order, so they are matched by document id.
+        """
+        by_id = {rows[index].get('uuid'): index for index in chunk}
+        results = streaming_bulk(
+            self.es,
+            (MessageIndex.to_action(rows[index]) for index in chunk),
+            chunk_size=self.chunk_size,
+            max_retries=self.max_retries,
+            initial_backoff=self.initial_backoff,
+            max_backoff=self.max_backoff,
+            raise_on_error=False,
+            raise_on_exception=False,
+            yield_ok=False,
+        )
+        transient = []
+        permanent = []
+
+        for _, item in results:
+            details = next(iter(item.values()))
+            index = by_id.get(details.get('_id'))
+
+            if index is None:
+                # whole request failed, nothing of the chunk is known to be saved
+                return list(chunk), []
+
+            if is_transient(item):
+                transient.append(index)
+            else:
+                permanent.append((rows[index], details.get('error')))
+
+        return transient, permanent
+
+
+class StreamIndexer(object):
+    """
+    Moves messages from the redis streams to the MessageIndex.
+    Entries are acknowledged only after elasticsearch accepted them or they went to the dead letters,
+    so every message is indexed at least once. Entries left pending by other consumers for `claim_idle`
+    milliseconds are claimed, so nothing is lost with an indexer that never comes back under its name.
+    Documents use message uuid as id, so redelivered entries overwrite instead of duplicating.
+    """
+
+    def __init__(self, stream, consumer, shards, batch_size, block, indexer=None, claim_idle=None):
+        self.stream = stream
+        self.consumer = consumer
+        self.keys = [stream.key.format(shard) for shard in shards]
+        self.batch_size = batch_size
+        self.block = block
+        self.indexer = indexer or BulkIndexer()
+        self.backoff = 0
+        self.claim_idle = claim_idle or settings.INDEXER_CLAIM_IDLE
+        self.next_claim = 0
+
+    def run(self):
+        self.stream.ensure_group(self.keys)
+
+        # entries delivered to this consumer before restart and never acknowledged
+        pending = self.stream.read(self.consumer, self.keys, self.batch_size, pending=True)
+
+        if pending:
+            self.index(pending)
+
+        while True:
+            if time.monotonic() >= self.next_claim:
+                self.next_claim = time.monotonic() + self.claim_idle / 1000
+                claimed = self.stream.claim(self.consumer, self.keys, self.claim_idle, self.batch_size)
+
+                if claimed:
+                    logger.warning('%d entries claimed from other consumers', len(claimed))
+                    self.index(claimed)
+
+            if self.backoff:
+                # entries left unacknowledged by a transient failure are read again after a pause
+                time.sleep(self.backoff)
+                entries = self.stream.read(self.consumer, self.keys, self.batch_size, pending=True)
+            else:
+                entries = self.stream.read(self.consumer, self.keys, self.batch_size, block=self.block)
+
+            if entries:
+                self.index(entries)
+            else:
+                self.backoff = 0
+
+    def index(self, entries):
+        done = [(key, entry_id) for key, entry_id, row in entries if row is None]
+        rows = [entry for entry in entries if entry[2] is not None]
+        retry = set(self.indexer.index([row for _, _, row in rows]))
+        done += [(key, entry_id) for index, (key, entry_id, _) in enumerate(rows) if index not in retry]
+
+        if retry:
+            logger.warning('%d messages will be retried', len(retry))
+            self.backoff = min(max(self.backoff * 2, self.indexer.initial_backoff), self.indexer.max_backoff)
+        else:
+            self.backoff = 0
+
+        if done:
+            self.stream.ack(done)
+
+        return len(done)
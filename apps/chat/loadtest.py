@@ -0,0 +1,161 @@
+import asyncio
+import json
+import os
+import random
+import resource
+import time
+
+from autobahn.asyncio.websocket import WebSocketClientFactory, WebSocketClientProtocol
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+
+
+class LoadTestStats(object):
+    """
+    Counters and end-to-end latencies collected by simulated clients.
+    """
+
+    def __init__(self):
+        self.connected = 0
+        self.sent = 0
+        self.received = 0
+        self.errors = 0
+        self.latencies = []
+
+    def percentile(self, value):
+        if not self.latencies:
+            return 0
+
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * value / 100))]
+
+
+class CommunicatorClient(object):
+    """
+    In-process client, drives the ASGI application directly.
+    WebsocketCommunicator of channels 2.0 copies the path as is, so the token goes into the scope query string.
+    """
+
+    def __init__(self, application, token, subprotocols=None):
+        query_string = 'token={}'.format(token).encode()
+        self.communicator = WebsocketCommunicator(
+            lambda scope: application(dict(scope, query_string=query_string)), '/chat/', subprotocols=subprotocols
+        )
+
+    async def connect(self):
+        connected, _ = await self.communicator.connect()
+        return connected
+
+    async def send(self, content):
+        await self.communicator.send_json_to(content)
+
+    async def receive(self):
+        return await self.communicator.receive_json_from(timeout=3600)
+
+    async def close(self):
+        await self.communicator.disconnect()
+
+
+class WebsocketClientProtocol(WebSocketClientProtocol):
+
+    def onOpen(self):
+        self.factory.opened.set_result(True)
+
+    def onMessage(self, payload, is_binary):
+        self.factory.frames.put_nowait(json.loads(payload.decode('utf8')))
+
+    def onClose(self, was_clean, code, reason):
+        if not self.factory.opened.done():
+            self.factory.opened.set_result(False)
+
+
+class WebsocketClient(object):
+    """
+    Raw websocket client, talks to a running daphne.
+    """
+
+    def __init__(self, url, token):
+        self.factory = WebSocketClientFactory('{}?token={}'.format(url, token))
+        self.factory.protocol = WebsocketClientProtocol
+        self.factory.frames = asyncio.Queue()
+        self.factory.opened = asyncio.get_event_loop().create_future()
+        self.url = url
+        self.protocol = None
+
+    async def connect(self):
+        host, _, port = self.url.split('/')[2].partition(':')
+        _, self.protocol = await asyncio.get_event_loop().create_connection(self.factory, host, int(port or 80))
+        return await self.factory.opened
+
+    async def send(self, content):
+        self.protocol.sendMessage(json.dumps(content).encode('utf8'))
+
+    async def receive(self):
+        return await self.factory.frames.get()
+
+    async def close(self):
+        self.protocol.sendClose()
+
+
+async def receive_frames(client, stats):
+    """
+    Count delivered chat messages and record their latency, messages carry send time.
+    """
+    while True:
+        frame = await client.receive()
+
+        if 'error' in frame:
+            stats.errors += 1
+        elif frame.get('msg_type') == settings.MSG_TYPE_MESSAGE:
+            stats.received += 1
+            stats.latencies.append(time.time() - json.loads(frame['message'])['ts'])
+
+
+async def run_client(client, rooms, stats, options, deadline):
+    """
+    Simulated user: joins a few rooms, then sends messages and sometimes moves to another room.
+    """
+    loop = asyncio.get_event_loop()
+
+    if not await client.connect():
+        stats.errors += 1
+        return
+
+    stats.connected += 1
+    receiver = asyncio.ensure_future(receive_frames(client, stats))
+    joined = random.sample(rooms, min(options['rooms_per_client'], len(rooms)))
+    await client.send({'command': 'join_many', 'rooms': joined})
+
+    try:
+        while loop.time() < deadline:
+            await asyncio.sleep(random.expovariate(options['rate']))
+
+            if random.random() < options['leave_ratio']:
+                room = joined.pop(random.randrange(len(joined)))
+                await client.send({'command': 'leave', 'room': room})
+                joined.append(random.choice(rooms))
+                await client.send({'command': 'join', 'room': joined[-1]})
+            else:
+                room = random.choice(joined)
+                await client.send({'command': 'send', 'room': room, 'message': json.dumps({'ts': time.time()})})
+                stats.sent += 1
+    finally:
+        receiver.cancel()
+        await client.close()
+
+
+def cpu_and_rss(pid=None):
+    """
+    Total CPU seconds and resident memory in MB of the process, current one by default.
+    """
+    if pid is None:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return usage.ru_utime + usage.ru_stime, usage.ru_maxrss / 1024
+
+    with open('/proc/{}/stat'.format(pid)) as stat:
+        fields = stat.read().rsplit(')', 1)[1].split()
+
+    with open('/proc/{}/status'.format(pid)) as status:
+        rss = next(int(line.split()[1]) for line in status if line.startswith('VmRSS'))
+
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK'), rss / 1024
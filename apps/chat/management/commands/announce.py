@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from apps.chat.announcements import send_announcement
+from apps.chat.models import Announcement
+
+
+class Command(BaseCommand):
+    help = 'Send an ALERT to every connected user and report how many connections got it.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('message')
+        parser.add_argument('--wait', type=float, default=5, help='Seconds to wait for worker reports.')
+
+    def handle(self, *args, **options):
+        announcement = send_announcement(Announcement.objects.create(message=options['message']), options['wait'])
+        self.stdout.write('delivered to {} connections on {} workers'.format(
+            announcement.delivered, announcement.workers
+        ))
@@ -0,0 +1,102 @@
+import asyncio
+import json
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand
+
+from apps.chat.consumers import ChatConsumer
+from apps.chat.outbound import OutboundQueue
+from apps.chat.protocol import encode_frame
+
+
+async def discard(text_data=None, bytes_data=None, close=False):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Measure CPU per delivered message for per-recipient and encode-once broadcast frames.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--members', type=int, nargs='+', default=[100, 1000, 5000])
+        parser.add_argument('--messages', type=int, default=100)
+        parser.add_argument('--size', type=int, default=200, help='Message length in characters.')
+
+    def handle(self, *args, **options):
+        loop = asyncio.get_event_loop()
+        message = 'x' * options['size']
+        self.stdout.write('{:>8} {:>16} {:>16} {:>8}'.format('members', 'per-recipient', 'encode-once', 'speedup'))
+
+        for members in options['members']:
+            consumers = self.consumers(members, options['messages'])
+            before = loop.run_until_complete(self.per_recipient(consumers, options['messages'], message))
+            after = loop.run_until_complete(self.encode_once(consumers, options['messages'], message))
+            self.stdout.write('{:>8} {:>13.3f} us {:>13.3f} us {:>7.1f}x'.format(
+                members, before, after, before / after
+            ))
+
+            for consumer in consumers:
+                consumer.outbound.stop()
+
+    @staticmethod
+    def consumers(members, messages):
+        """
+        Chat consumers with real outbound queues and writer tasks, frames are written to nowhere.
+        """
+        consumers = []
+
+        for _ in range(members):
+            consumer = ChatConsumer({'type': 'websocket', 'user': AnonymousUser()})
+            consumer.frame = 'text'
+            consumer.outbound = OutboundQueue(discard, discard, messages)
+            consumer.outbound.start()
+            consumers.append(consumer)
+
+        return consumers
+
+    @staticmethod
+    async def drain(consumers):
+        while any(len(consumer.outbound) for consumer in consumers):
+            await asyncio.sleep(0)
+
+    async def per_recipient(self, consumers, messages, message):
+        """
+        Old behaviour: every recipient builds the frame from the event and encodes it.
+        """
+        event = {'type': 'chat.message', 'room_uuid': 'room', 'username': 'user', 'message': message, 'seq': 1}
+        start = time.process_time()
+
+        for _ in range(messages):
+            for consumer in consumers:
+                consumer.outbound.put(json.dumps({
+                    'msg_type': settings.MSG_TYPE_MESSAGE,
+                    'room': event['room_uuid'],
+                    'username': event['username'],
+                    'message': event['message'],
+                    'seq': event['seq'],
+                }))
+
+        await self.drain(consumers)
+        return (time.process_time() - start) / (len(consumers) * messages) * 10 ** 6
+
+    async def encode_once(self, consumers, messages, message):
+        """
+        Current behaviour: send_room encodes the frame once, every recipient's chat_message forwards it.
+        """
+        start = time.process_time()
+
+        for _ in range(messages):
+            event = dict(type='chat.message', **encode_frame({
+                'msg_type': settings.MSG_TYPE_MESSAGE,
+                'room': 'room',
+                'username': 'user',
+                'message': message,
+                'seq': 1,
+            }))
+
+            for consumer in consumers:
+                await consumer.chat_message(event)
+
+        await self.drain(consumers)
+        return (time.process_time() - start) / (len(consumers) * messages) * 10 ** 6
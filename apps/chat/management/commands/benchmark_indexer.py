@@ -0,0 +1,52 @@
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from elasticsearch_dsl.connections import connections
+
+from apps.chat.indexer import BulkIndexer
+from apps.repositories.search import MessageIndex
+
+# messages are dated into a month of their own, its index is dropped after every run
+CREATED = '2000-01-01T00:00:00+00:00'
+
+
+class Command(BaseCommand):
+    help = 'Measure indexing throughput for combinations of bulk chunk size and threads.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=100000)
+        parser.add_argument('--rooms', type=int, default=100)
+        parser.add_argument('--chunk-sizes', type=int, nargs='+', default=[500, 2000])
+        parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4])
+
+    def handle(self, *args, **options):
+        es = connections.get_connection()
+        index = MessageIndex.index_for(CREATED)
+        rooms = [str(uuid.uuid4()) for _ in range(options['rooms'])]
+        rows = [
+            {
+                'room': rooms[i % len(rooms)],
+                'user': 'user{}'.format(i % 1000),
+                'created': CREATED,
+                'message': 'message number {} with a few more words to index'.format(i),
+                'status': 0,
+                'tags': [],
+                'uuid': str(uuid.uuid4()),
+                'seq': i,
+            }
+            for i in range(options['messages'])
+        ]
+        self.stdout.write('{:>10} {:>8} {:>12} {:>8}'.format('chunk', 'threads', 'docs/s', 'retried'))
+
+        for chunk_size in options['chunk_sizes']:
+            for threads in options['threads']:
+                indexer = BulkIndexer(es, chunk_size=chunk_size, threads=threads)
+                start = time.perf_counter()
+                retry = indexer.index(rows)
+                es.indices.refresh(index=index)
+                elapsed = time.perf_counter() - start
+                es.indices.delete(index=index)
+                self.stdout.write('{:>10} {:>8} {:>12.0f} {:>8}'.format(
+                    chunk_size, threads, len(rows) / elapsed, len(retry)
+                ))
@@ -0,0 +1,48 @@
+import random
+import string
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from apps.chat.moderation import ModerationFilter, build_automaton
+
+
+class Command(BaseCommand):
+    help = 'Measure the moderation scan time per message for banned word lists of different sizes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--words', type=int, nargs='+', default=[1000, 10000, 50000])
+        parser.add_argument('--size', type=int, default=200, help='Message length in characters.')
+        parser.add_argument('--messages', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        messages = [self.text(options['size']) for _ in range(100)]
+        self.stdout.write('{:>8} {:>12} {:>14}'.format('words', 'build ms', 'scan us/msg'))
+
+        for count in options['words']:
+            words = [(self.word(), settings.MSG_TYPE_WARNING) for _ in range(count)]
+            start = time.process_time()
+            moderation = ModerationFilter()
+            moderation.automaton = build_automaton(words)
+            build = time.process_time() - start
+
+            start = time.process_time()
+
+            for i in range(options['messages']):
+                moderation.scan(messages[i % len(messages)])
+
+            scan = (time.process_time() - start) / options['messages'] * 10 ** 6
+            self.stdout.write('{:>8} {:>12.1f} {:>14.2f}'.format(count, build * 1000, scan))
+
+    @staticmethod
+    def word():
+        return ''.join(random.choice(string.ascii_lowercase) for _ in range(random.randint(4, 12)))
+
+    def text(self, size):
+        words = []
+
+        while sum(len(word) + 1 for word in words) < size:
+            words.append(self.word())
+
+        return ' '.join(words)[:size]
@@ -0,0 +1,76 @@
+import json
+import time
+import uuid
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from apps.chat.protocol import encode_msgpack
+
+
+class Command(BaseCommand):
+    help = 'Compare payload size and encode time of JSON and msgpack frames.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=40, help='Message length in characters.')
+        parser.add_argument('--history', type=int, default=50, help='Messages in the join frame.')
+        parser.add_argument('--repeat', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        frames = self.frames(options['size'], options['history'])
+        self.stdout.write('{:>10} {:>10} {:>10} {:>7} {:>12} {:>12}'.format(
+            'frame', 'json B', 'msgpack B', 'size', 'json us', 'msgpack us'
+        ))
+
+        for name, content in frames.items():
+            text = json.dumps(content).encode('utf8')
+            binary = encode_msgpack(content)
+            json_time = self.encode_time(lambda: json.dumps(content), options['repeat'])
+            msgpack_time = self.encode_time(lambda: encode_msgpack(content), options['repeat'])
+            self.stdout.write('{:>10} {:>10} {:>10} {:>6.0f}% {:>12.2f} {:>12.2f}'.format(
+                name, len(text), len(binary), len(binary) / len(text) * 100, json_time, msgpack_time
+            ))
+
+    @staticmethod
+    def frames(size, history):
+        room = str(uuid.uuid4())
+        message = {
+            'msg_type': settings.MSG_TYPE_MESSAGE,
+            'room': room,
+            'username': 'someone',
+            'message': 'x' * size,
+            'seq': 123456,
+        }
+        stored = {
+            'room': room,
+            'user': {'username': 'someone'},
+            'created': timezone.now().isoformat(),
+            'message': 'x' * size,
+            'status': settings.MSG_TYPE_MESSAGE,
+            'tags': [],
+            'uuid': str(uuid.uuid4()),
+            'seq': 123456,
+        }
+        return {
+            'message': message,
+            'presence': {
+                'msg_type': settings.MSG_TYPE_PRESENCE,
+                'room': room,
+                'joined': ['user{}'.format(i) for i in range(5)],
+                'left': ['user{}'.format(i) for i in range(5, 7)],
+            },
+            'join': {'join': room, 'messages': [stored] * history},
+        }
+
+    @staticmethod
+    def encode_time(encode, repeat):
+        """
+        CPU microseconds per encoded frame.
+        """
+        start = time.process_time()
+
+        for _ in range(repeat):
+            encode()
+
+        return (time.process_time() - start) / repeat * 10 ** 6
@@ -0,0 +1,55 @@
+import functools
+import multiprocessing
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.chat.export import EXTENSIONS, export_slice
+
+
+class Command(BaseCommand):
+    help = 'Export message history of a room, a date range or everything to compressed NDJSON files.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='Directory for the files, created if missing.')
+        parser.add_argument('--room', help='Room UUID, all rooms if not set.')
+        parser.add_argument('--since', help='ISO date, inclusive.')
+        parser.add_argument('--until', help='ISO date, exclusive.')
+        parser.add_argument('--slices', type=int, default=os.cpu_count(), help='Parallel scroll slices and processes.')
+        parser.add_argument('--compression', choices=sorted(EXTENSIONS), default='gzip')
+        parser.add_argument('--max-size', type=int, default=256, help='Megabytes per file.')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Documents per scroll page.')
+
+    def handle(self, *args, **options):
+        if options['slices'] < 1:
+            raise CommandError('--slices has to be at least 1')
+
+        os.makedirs(options['output'], exist_ok=True)
+
+        if os.listdir(options['output']):
+            raise CommandError('{} is not empty'.format(options['output']))
+
+        export = functools.partial(
+            export_slice,
+            slices=options['slices'],
+            directory=options['output'],
+            compression=options['compression'],
+            max_bytes=options['max_size'] * 1024 * 1024,
+            batch_size=options['batch_size'],
+            room=options['room'],
+            since=options['since'],
+            until=options['until'],
+        )
+        start = time.perf_counter()
+
+        with multiprocessing.Pool(options['slices']) as pool:
+            results = pool.map(export, range(options['slices']))
+
+        elapsed = time.perf_counter() - start
+        rows = sum(count for count, _ in results)
+        files = [path for _, paths in results for path in paths]
+
+        self.stdout.write('{} messages in {} files, {:.1f}s ({:.0f} docs/s)'.format(
+            rows, len(files), elapsed, rows / elapsed if elapsed else 0
+        ))
@@ -0,0 +1,113 @@
+import asyncio
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from rest_framework_jwt.settings import api_settings
+
+from apps.chat.loadtest import CommunicatorClient, LoadTestStats, WebsocketClient, cpu_and_rss, run_client
+from apps.chat.models import Room
+from chatter.routing import application
+
+User = get_user_model()
+
+jwt_payload_handler = api_settings.JWT_PAYLOAD_HANDLER
+jwt_encode_handler = api_settings.JWT_ENCODE_HANDLER
+
+IN_MEMORY_CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+    },
+}
+
+
+class Command(BaseCommand):
+    help = 'Load test the chat with simulated websocket clients issuing a join/send/leave mix.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=1000)
+        parser.add_argument('--rooms', type=int, default=50)
+        parser.add_argument('--rooms-per-client', type=int, default=3)
+        parser.add_argument('--duration', type=int, default=60, help='Seconds.')
+        parser.add_argument('--rate', type=float, default=0.5, help='Commands per second per client.')
+        parser.add_argument('--leave-ratio', type=float, default=0.05, help='Share of commands moving to another room.')
+        parser.add_argument('--ramp-up', type=float, default=10, help='Seconds to open all connections.')
+        parser.add_argument(
+            '--url', default=None,
+            help='Websocket url of a running daphne, e.g. ws://localhost:8001/chat/. In-process run if not set.'
+        )
+        parser.add_argument('--layer', choices=('memory', 'redis'), default='memory', help='In-process runs only.')
+        parser.add_argument('--worker-pids', type=int, nargs='+', default=[], help='Daphne workers to report.')
+
+    def handle(self, *args, **options):
+        rooms = self.get_rooms(options['rooms'])
+        tokens = self.get_tokens(options['clients'])
+        # clients are expected to flood, keep the throttle out of the measurement
+        overrides = {
+            'SEND_RATE_USER': 10 ** 6,
+            'SEND_BURST_USER': 10 ** 6,
+            'SEND_RATE_ROOM': 10 ** 6,
+            'SEND_BURST_ROOM': 10 ** 6,
+        }
+
+        if options['url'] is None and options['layer'] == 'memory':
+            overrides['CHANNEL_LAYERS'] = IN_MEMORY_CHANNEL_LAYERS
+
+        with override_settings(**overrides):
+            stats, elapsed, usage = asyncio.get_event_loop().run_until_complete(self.run(rooms, tokens, options))
+
+        self.report(stats, elapsed, usage, options)
+
+    def get_rooms(self, count):
+        rooms = [str(pk) for pk in Room.objects.values_list('pk', flat=True)[:count]]
+        created = Room.objects.bulk_create([Room() for _ in range(count - len(rooms))])
+        return rooms + [str(room.pk) for room in created]
+
+    def get_tokens(self, count):
+        """
+        JWT tokens for loadtest users, missing users are created without signals.
+        """
+        usernames = ['loadtest{}'.format(i) for i in range(count)]
+        existing = set(User.objects.filter(username__in=usernames).values_list('username', flat=True))
+        User.objects.bulk_create([
+            User(username=username, email='{}@loadtest.local'.format(username), is_active=True)
+            for username in usernames if username not in existing
+        ])
+        return [jwt_encode_handler(jwt_payload_handler(user)) for user in User.objects.filter(username__in=usernames)]
+
+    async def run(self, rooms, tokens, options):
+        stats = LoadTestStats()
+        loop = asyncio.get_event_loop()
+        usage = {pid: cpu_and_rss(pid) for pid in [None] + options['worker_pids']}
+        start = loop.time()
+        deadline = start + options['ramp_up'] + options['duration']
+        tasks = []
+
+        for token in tokens:
+            if options['url']:
+                client = WebsocketClient(options['url'], token)
+            else:
+                client = CommunicatorClient(application, token)
+
+            tasks.append(asyncio.ensure_future(run_client(client, rooms, stats, options, deadline)))
+            await asyncio.sleep(options['ramp_up'] / len(tokens))
+
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        stats.errors += sum(isinstance(result, Exception) for result in results)
+        elapsed = loop.time() - start
+        usage = {pid: (cpu_and_rss(pid)[0] - cpu, cpu_and_rss(pid)[1]) for pid, (cpu, _) in usage.items()}
+        return stats, elapsed, usage
+
+    def report(self, stats, elapsed, usage, options):
+        self.stdout.write('mode: {}'.format(options['url'] or 'in-process, {} layer'.format(options['layer'])))
+        self.stdout.write('clients: {} connected, {} errors'.format(stats.connected, stats.errors))
+        self.stdout.write('sent: {} ({:.1f} msg/s)'.format(stats.sent, stats.sent / elapsed))
+        self.stdout.write('delivered: {} ({:.1f} msg/s)'.format(stats.received, stats.received / elapsed))
+        self.stdout.write('latency ms: p50 {:.1f}, p95 {:.1f}, p99 {:.1f}'.format(
+            *[stats.percentile(value) * 1000 for value in (50, 95, 99)]
+        ))
+
+        for pid, (cpu, rss) in usage.items():
+            self.stdout.write('{}: cpu {:.1f}s ({:.0f}%), rss {:.0f} MB'.format(
+                'load test process' if pid is None else 'worker {}'.format(pid), cpu, cpu / elapsed * 100, rss
+            ))
@@ -0,0 +1,70 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from elasticsearch.helpers import reindex, scan, streaming_bulk
+from elasticsearch_dsl.connections import connections
+
+from apps.repositories.search import INDEX_ALIAS, INDEX_NAME, INDEX_PATTERN, MessageIndex
+
+LEGACY_INDEX = 'message_legacy'
+
+
+class Command(BaseCommand):
+    help = 'Manage monthly message indices: install the template, drop old months, migrate the single legacy index.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=('init', 'drop', 'migrate'))
+        parser.add_argument('--keep', type=int, default=12, help='Months to keep when dropping, current included.')
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        self.es = connections.get_connection()
+        self.dry_run = options['dry_run']
+        getattr(self, options['action'])(options)
+
+    def init(self, options):
+        MessageIndex.init_template(self.es)
+        self.stdout.write('Template {} installed'.format(INDEX_ALIAS))
+
+    def drop(self, options):
+        """
+        Delete whole monthly indices older than the last `keep` months.
+        """
+        if options['keep'] < 1:
+            raise CommandError('--keep has to be at least 1')
+
+        today = datetime.date.today()
+        months = today.year * 12 + today.month - options['keep']
+        oldest = INDEX_NAME.format('{:04d}-{:02d}'.format(months // 12, months % 12 + 1))
+
+        for index in sorted(self.es.indices.get(index=INDEX_PATTERN)):
+            if index < oldest:
+                self.stdout.write('Dropping {}'.format(index))
+
+                if not self.dry_run:
+                    self.es.indices.delete(index=index)
+
+    def migrate(self, options):
+        """
+        Move messages of the single `message` index into monthly indices, routed by room.
+        The old index is renamed first, so its name can become the read alias.
+        """
+        if not self.es.indices.exists(index=INDEX_ALIAS) or self.es.indices.exists_alias(name=INDEX_ALIAS):
+            raise CommandError('There is no legacy {} index'.format(INDEX_ALIAS))
+
+        if self.dry_run:
+            self.stdout.write('{} documents to migrate'.format(self.es.count(index=INDEX_ALIAS)['count']))
+            return
+
+        reindex(self.es, INDEX_ALIAS, LEGACY_INDEX)
+        self.es.indices.delete(index=INDEX_ALIAS)
+        MessageIndex.init_template(self.es)
+
+        rows = (hit['_source'] for hit in scan(self.es, index=LEGACY_INDEX, size=1000))
+        migrated = 0
+
+        for ok, item in streaming_bulk(self.es, (MessageIndex.to_action(row) for row in rows), chunk_size=1000):
+            migrated += ok
+
+        self.es.indices.delete(index=LEGACY_INDEX)
+        self.stdout.write('{} documents migrated'.format(migrated))
@@ -0,0 +1,121 @@
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from redis import StrictRedis
+
+from apps.chat.presence import PresenceStore
+from apps.chat.sharding import HashRing, parse_node
+from apps.repositories.redis_interface import RedisInterface
+
+
+class Command(BaseCommand):
+    help = (
+        'Move room groups and per-room chat state to their nodes after CHANNEL_REDIS_NODES or '
+        'REDIS_CHAT_NODES were changed. Pass the previous node lists.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--old-channel-nodes', nargs='+', default=[], help='Previous CHANNEL_REDIS_NODES.')
+        parser.add_argument('--old-chat-nodes', nargs='+', default=[], help='Previous REDIS_CHAT_NODES.')
+        parser.add_argument('--dry-run', action='store_true', help='Only count keys which have to move.')
+
+    def handle(self, *args, **options):
+        self.dry_run = options['dry_run']
+
+        if options['old_channel_nodes']:
+            self.rebalance_groups(options['old_channel_nodes'])
+
+        if options['old_chat_nodes']:
+            self.rebalance_rooms(options['old_chat_nodes'])
+
+    def client(self, node, db=0):
+        host, port = parse_node(node)
+        return StrictRedis(host=host, port=port, db=db)
+
+    def rebalance_groups(self, old_nodes):
+        """
+        Merge group membership sorted sets into the node the current ring assigns them to.
+        """
+        layer = get_channel_layer()
+        prefix = layer._group_key('')
+        clients = {node: self.client(node) for node in set(old_nodes) | set(settings.CHANNEL_REDIS_NODES)}
+
+        for node in old_nodes:
+            moved = 0
+
+            for key in clients[node].scan_iter(match=prefix + b'*', count=1000):
+                target = layer.ring.get_node(key[len(prefix):].decode('utf8'))
+
+                if target == node:
+                    continue
+
+                moved += 1
+
+                if self.dry_run:
+                    continue
+
+                members = clients[node].zrange(key, 0, -1, withscores=True)
+
+                if members:
+                    pipe = clients[target].pipeline(transaction=False)
+                    pipe.zadd(key, *[value for member, score in members for value in (score, member)])
+                    pipe.expire(key, layer.group_expiry)
+                    pipe.execute()
+
+                clients[node].delete(key)
+
+            self.stdout.write('{}: {} groups moved'.format(node, moved))
+
+    def rebalance_rooms(self, old_nodes):
+        """
+        Move room history, sequence and presence keys to their new nodes.
+        Sorted sets are merged, sequence keeps the highest value, history is copied only if the target has none.
+        """
+        ring = HashRing(settings.REDIS_CHAT_NODES)
+        db = settings.REDIS_CHAT_URL_DB
+        clients = {node: self.client(node, db) for node in set(old_nodes) | set(settings.REDIS_CHAT_NODES)}
+        patterns = [RedisInterface.key, RedisInterface.seq_key, PresenceStore.key]
+
+        for node in old_nodes:
+            moved = 0
+
+            for pattern in patterns:
+                prefix = pattern.format('').encode()
+
+                for key in clients[node].scan_iter(match=prefix + b'*', count=1000):
+                    target = ring.get_node(key[len(prefix):].decode('utf8'))
+
+                    if target == node:
+                        continue
+
+                    moved += 1
+
+                    if not self.dry_run:
+                        self.move_key(clients[node], clients[target], key)
+
+            self.stdout.write('{}: {} room keys moved'.format(node, moved))
+
+    def move_key(self, source, target, key):
+        key_type = source.type(key)
+        ttl = max(source.pttl(key), 0)
+
+        if key_type == b'zset':
+            members = source.zrange(key, 0, -1, withscores=True)
+
+            if members:
+                target.zadd(key, *[value for member, score in members for value in (score, member)])
+        elif key_type == b'string':
+            value = int(source.get(key) or 0)
+
+            if value > int(target.get(key) or 0):
+                target.set(key, value)
+        elif not target.exists(key):
+            dump = source.dump(key)
+
+            if dump is not None:
+                target.restore(key, ttl, dump)
+
+        if ttl and key_type != b'list':
+            target.pexpire(key, ttl)
+
+        source.delete(key)
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from apps.chat.indexer import BulkIndexer, dead_letters
+
+
+class Command(BaseCommand):
+    help = 'Index messages from the dead letters again, e.g. after a mapping fix. Failing ones go back.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--count', action='store_true', help='Only print the number of dead letters.')
+
+    def handle(self, *args, **options):
+        if options['count']:
+            self.stdout.write('{} dead letters'.format(len(dead_letters)))
+            return
+
+        indexer = BulkIndexer()
+        replayed = 0
+
+        # only letters present at start are replayed, rows failing again are appended behind them
+        for _ in range(0, len(dead_letters), options['batch_size']):
+            rows = dead_letters.pop(options['batch_size'])
+            retry = indexer.index(rows)
+
+            if retry:
+                dead_letters.push([(rows[index], 'replay failed') for index in retry])
+
+            replayed += len(rows)
+
+        self.stdout.write('{} messages replayed, {} dead letters left'.format(replayed, len(dead_letters)))
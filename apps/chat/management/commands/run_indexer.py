@@ -0,0 +1,38 @@
+import os
+import socket
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from apps.chat.indexer import BulkIndexer, StreamIndexer
+from apps.chat.stream import message_stream
+
+
+class Command(BaseCommand):
+    help = 'Index chat messages from the redis streams into elasticsearch.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--consumer', default='{}-{}'.format(socket.gethostname(), os.getpid()),
+            help='Consumer name in the group. Entries pending for another name are claimed after --claim-idle.'
+        )
+        parser.add_argument(
+            '--shards', type=int, nargs='+', default=list(range(settings.MESSAGE_STREAM_SHARDS)),
+            help='Stream shards to read, all by default.'
+        )
+        parser.add_argument('--batch-size', type=int, default=settings.INDEXER_BATCH_SIZE)
+        parser.add_argument('--block', type=int, default=5000, help='Milliseconds to wait for new entries.')
+        parser.add_argument('--chunk-size', type=int, default=settings.INDEXER_CHUNK_SIZE)
+        parser.add_argument('--threads', type=int, default=settings.INDEXER_THREADS)
+        parser.add_argument(
+            '--claim-idle', type=int, default=settings.INDEXER_CLAIM_IDLE,
+            help='Milliseconds an entry of another consumer stays unacknowledged before it is claimed.'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write('Indexing shards {} as {}'.format(options['shards'], options['consumer']))
+        indexer = BulkIndexer(chunk_size=options['chunk_size'], threads=options['threads'])
+        StreamIndexer(
+            message_stream, options['consumer'], options['shards'], options['batch_size'], options['block'], indexer,
+            options['claim_idle']
+        ).run()
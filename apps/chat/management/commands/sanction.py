@@ -0,0 +1,36 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.chat.models import Room
+from apps.chat.sanctions import BAN, MUTE, sanctions
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Mute or ban a user in a room, or lift the sanction. Takes effect on every worker right away.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=('mute', 'unmute', 'ban', 'unban'))
+        parser.add_argument('username')
+        parser.add_argument('room', help='Room UUID.')
+        parser.add_argument('--duration', type=int, default=None, help='Seconds, permanent if not set.')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+            room = Room.objects.get(pk=options['room'])
+        except (User.DoesNotExist, Room.DoesNotExist) as e:
+            raise CommandError(e)
+
+        action = options['action']
+        kind = MUTE if action.endswith('mute') else BAN
+
+        if action.startswith('un'):
+            sanctions.remove(kind, str(room.pk), user.pk)
+            self.stdout.write('{}: {} lifted in {}'.format(user.username, kind, room.pk))
+        else:
+            sanctions.add(kind, str(room.pk), user.pk, options['duration'])
+            self.stdout.write('{}: {} in {} for {}'.format(
+                user.username, kind, room.pk, '{}s'.format(options['duration']) if options['duration'] else 'ever'
+            ))
@@ -14,6 +14,8 @@ class Message(NamedTuple):
     message: str
     status: str
     tags: List[str]
+    uuid: str = None
+    seq: int = None
 
     def to_dict(self):
         return {
@@ -22,5 +24,22 @@ class Message(NamedTuple):
             'created': self.created,
             'message': self.message,
             'status': self.status,
-            'tags': self.tags
+            'tags': self.tags,
+            'uuid': self.uuid,
+            'seq': self.seq
+        }
+
+    def to_document(self):
+        """
+        Flat representation stored in the MessageIndex.
+        """
+        return {
+            'room': self.room,
+            'user': self.user.username,
+            'created': self.created,
+            'message': self.message,
+            'status': self.status,
+            'tags': self.tags,
+            'uuid': self.uuid,
+            'seq': self.seq
         }
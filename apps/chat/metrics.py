@@ -0,0 +1,96 @@
+from django.conf import settings
+from prometheus_client import Counter, Histogram
+from prometheus_client.core import REGISTRY, CounterMetricFamily, GaugeMetricFamily
+
+from apps.chat.buffer import message_buffer
+from apps.chat.cache import room_cache, user_cache
+from apps.chat.outbound import outbound_stats
+
+COMMANDS = ('join', 'leave', 'join_many', 'leave_many', 'send', 'history', 'heartbeat', 'who', 'search', 'unknown')
+
+# latencies of the hot path are mostly well below a millisecond, room lookups and layer calls can take longer
+LATENCY_BUCKETS = (.0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, float('inf'))
+
+command_seconds = Histogram(
+    'chatter_command_seconds', 'Time to handle a websocket command.', ['command'], buckets=LATENCY_BUCKETS
+)
+command_errors = Counter('chatter_command_errors_total', 'Commands answered with a client error.', ['command'])
+room_lookup_seconds = Histogram(
+    'chatter_room_lookup_seconds', 'Time spent in get_room_or_error.', buckets=LATENCY_BUCKETS
+)
+group_send_seconds = Histogram(
+    'chatter_group_send_seconds', 'Time to broadcast an event to a room group.', ['fanout'], buckets=LATENCY_BUCKETS
+)
+group_add_seconds = Histogram(
+    'chatter_group_add_seconds', 'Time to add a connection to a room group.', ['fanout'], buckets=LATENCY_BUCKETS
+)
+moderated = Counter('chatter_moderated_total', 'Messages rejected by the moderation filter.', ['status'])
+send_json_seconds = Histogram(
+    'chatter_send_json_seconds', 'Time to encode and send a direct reply.', buckets=LATENCY_BUCKETS
+)
+
+# children are bound once, so timing a call is a dict lookup and an observe
+COMMAND_SECONDS = {command: command_seconds.labels(command) for command in COMMANDS}
+COMMAND_ERRORS = {command: command_errors.labels(command) for command in COMMANDS}
+GROUP_SEND_SECONDS = {fanout: group_send_seconds.labels(fanout) for fanout in ('local', 'layer')}
+GROUP_ADD_SECONDS = {fanout: group_add_seconds.labels(fanout) for fanout in ('local', 'layer')}
+MODERATED = {status: moderated.labels(status) for status in (settings.MSG_TYPE_WARNING, settings.MSG_TYPE_MUTED)}
+
+
+class ConnectionCollector(object):
+    """
+    Gauges computed at scrape time from live connections, the consumers don't pay for them.
+    The /metrics/ view runs in a thread of the sync handler while the event loop adds and removes connections,
+    so the sets are copied with list(), which doesn't give up the GIL, before they are iterated.
+    """
+
+    def __init__(self):
+        self.connections = set()
+
+    def collect(self):
+        rooms = [len(consumer.rooms) for consumer in list(self.connections)]
+
+        yield GaugeMetricFamily('chatter_connections', 'Open websocket connections.', value=len(rooms))
+        yield GaugeMetricFamily('chatter_room_memberships', 'Rooms joined over all connections.', value=sum(rooms))
+
+        rooms_per_connection = GaugeMetricFamily(
+            'chatter_rooms_per_connection', 'Rooms joined by a single connection.', labels=['stat']
+        )
+        rooms_per_connection.add_metric(['mean'], sum(rooms) / len(rooms) if rooms else 0)
+        rooms_per_connection.add_metric(['max'], max(rooms, default=0))
+        yield rooms_per_connection
+
+        outbound = outbound_stats.to_dict()
+        yield GaugeMetricFamily(
+            'chatter_outbound_depth', 'Frames waiting in outbound queues.', value=outbound['depth_total']
+        )
+
+        for name in ('dropped', 'disconnected'):
+            yield CounterMetricFamily(
+                'chatter_outbound_{}_total'.format(name), 'Outbound queue frames {}.'.format(name), value=outbound[name]
+            )
+
+        for cache_name, cache in (('room', room_cache), ('user', user_cache)):
+            stats = cache.stats()
+
+            for name in ('size', 'max_size'):
+                yield GaugeMetricFamily(
+                    'chatter_{}_cache_{}'.format(cache_name, name), 'Cache {}.'.format(name), value=stats[name]
+                )
+
+            for name in ('hits', 'misses', 'evictions'):
+                yield CounterMetricFamily(
+                    'chatter_{}_cache_{}_total'.format(cache_name, name), 'Cache {}.'.format(name), value=stats[name]
+                )
+
+        yield GaugeMetricFamily(
+            'chatter_buffer_size', 'Messages waiting for persistence.', value=len(message_buffer.rows)
+        )
+        yield CounterMetricFamily('chatter_buffer_flushed_total', 'Messages persisted.', value=message_buffer.flushed)
+        yield CounterMetricFamily(
+            'chatter_buffer_dropped_total', 'Messages dropped by the buffer.', value=message_buffer.dropped
+        )
+
+
+connections = ConnectionCollector()
+REGISTRY.register(connections)
@@ -0,0 +1,95 @@
+from urllib.parse import parse_qs
+
+import jwt
+from channels.db import database_sync_to_async
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from rest_framework_jwt.settings import api_settings
+
+from apps.chat.cache import user_cache
+
+User = get_user_model()
+
+# Browsers can't set headers on websocket handshake, so token is sent either in the query string
+# (`?token=<jwt>`) or as a pair of subprotocols: `access_token, <jwt>`.
+TOKEN_SUBPROTOCOL = 'access_token'
+
+jwt_decode_handler = api_settings.JWT_DECODE_HANDLER
+jwt_get_user_id_from_payload = api_settings.JWT_PAYLOAD_GET_USER_ID_HANDLER
+
+
+def get_token(scope):
+    params = parse_qs(scope.get('query_string', b'').decode())
+
+    if params.get('token'):
+        return params['token'][0]
+
+    subprotocols = scope.get('subprotocols') or []
+
+    if TOKEN_SUBPROTOCOL in subprotocols:
+        index = subprotocols.index(TOKEN_SUBPROTOCOL) + 1
+
+        if index < len(subprotocols):
+            return subprotocols[index]
+
+    return None
+
+
+@database_sync_to_async
+def get_user(user_id):
+    try:
+        return User.objects.get(pk=user_id, is_active=True)
+    except User.DoesNotExist:
+        return None
+
+
+async def get_jwt_user(token):
+    """
+    Verify token signature locally and resolve the user through the per-process cache.
+    """
+    try:
+        payload = jwt_decode_handler(token)
+    except jwt.InvalidTokenError:
+        return AnonymousUser()
+
+    user_id = jwt_get_user_id_from_payload(payload)
+    user = user_cache.get(user_id)
+
+    if user is None:
+        generation = user_cache.generation
+        user = await get_user(user_id)
+
+        if user is None:
+            return AnonymousUser()
+
+        user_cache.set(user_id, user, generation)
+
+    return user
+
+
+class JWTAuthMiddleware(object):
+    """
+    Authenticates websocket handshake with rest_framework_jwt token.
+    Scope user is left untouched when there is no token, so session authentication still works.
+    """
+
+    def __init__(self, inner):
+        self.inner = inner
+
+    def __call__(self, scope):
+        return JWTAuthMiddlewareInstance(scope, self.inner)
+
+
+class JWTAuthMiddlewareInstance(object):
+
+    def __init__(self, scope, inner):
+        self.scope = dict(scope)
+        self.inner = inner
+
+    async def __call__(self, receive, send):
+        token = get_token(self.scope)
+
+        if token is not None:
+            self.scope['user'] = await get_jwt_user(token)
+
+        return await self.inner(self.scope)(receive, send)
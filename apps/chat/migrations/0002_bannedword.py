@@ -0,0 +1,19 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BannedWord',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('word', models.CharField(help_text='Word or phrase, matched case-insensitively as a whole word.', max_length=255, unique=True, verbose_name='Word')),
+                ('status', models.PositiveSmallIntegerField(choices=[(1, 'Warning'), (3, 'Muted')], default=1, help_text='Frame sent to the author of a message containing the word.', verbose_name='Status')),
+            ],
+        ),
+    ]
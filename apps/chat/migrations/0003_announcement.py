@@ -0,0 +1,22 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_bannedword'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Announcement',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('message', models.TextField(verbose_name='Message')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Created')),
+                ('sent', models.DateTimeField(blank=True, null=True, verbose_name='Sent')),
+                ('workers', models.PositiveIntegerField(default=0, help_text='Websocket workers which reported the delivery.', verbose_name='Workers')),
+                ('delivered', models.PositiveIntegerField(default=0, help_text='Connections the alert was sent to.', verbose_name='Delivered')),
+            ],
+        ),
+    ]
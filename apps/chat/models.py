@@ -1,8 +1,14 @@
 import uuid
 
+from django.conf import settings
 from django.db import models
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.utils.translation import ugettext as _
 
+from apps.chat.cache import invalidate_room
+from apps.chat.pubsub import bus
+
 
 class Room(models.Model):
     id = models.UUIDField(
@@ -27,3 +33,59 @@ class Room(models.Model):
         messages as they are generated.
         """
         return 'room-{}'.format(self.id)
+
+
+class BannedWord(models.Model):
+    STATUS_CHOICES = (
+        (settings.MSG_TYPE_WARNING, _('Warning')),
+        (settings.MSG_TYPE_MUTED, _('Muted')),
+    )
+
+    word = models.CharField(
+        _('Word'),
+        max_length=255,
+        unique=True,
+        help_text=_('Word or phrase, matched case-insensitively as a whole word.')
+    )
+    status = models.PositiveSmallIntegerField(
+        _('Status'),
+        choices=STATUS_CHOICES,
+        default=settings.MSG_TYPE_WARNING,
+        help_text=_('Frame sent to the author of a message containing the word.')
+    )
+
+    def __str__(self):
+        return self.word
+
+
+class Announcement(models.Model):
+    message = models.TextField(_('Message'))
+    created = models.DateTimeField(_('Created'), auto_now_add=True)
+    sent = models.DateTimeField(_('Sent'), null=True, blank=True)
+    workers = models.PositiveIntegerField(
+        _('Workers'),
+        default=0,
+        help_text=_('Websocket workers which reported the delivery.')
+    )
+    delivered = models.PositiveIntegerField(
+        _('Delivered'),
+        default=0,
+        help_text=_('Connections the alert was sent to.')
+    )
+
+    def __str__(self):
+        return self.message[:50]
+
+
+@receiver(post_save, sender=Room)
+@receiver(post_delete, sender=Room)
+def invalidate_room_cache(sender, instance, **kwargs):
+    room_uuid = str(instance.pk)
+    invalidate_room(room_uuid)
+    bus.publish(settings.ROOM_CACHE_INVALIDATION_CHANNEL, room_uuid)
+
+
+@receiver(post_save, sender=BannedWord)
+@receiver(post_delete, sender=BannedWord)
+def reload_moderation(sender, instance, **kwargs):
+    bus.publish(settings.MODERATION_RELOAD_CHANNEL, str(instance.pk))
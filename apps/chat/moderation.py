@@ -0,0 +1,114 @@
+import asyncio
+import logging
+
+import ahocorasick
+from channels.db import database_sync_to_async
+from django.conf import settings
+
+from apps.chat.models import BannedWord
+from apps.chat.pubsub import bus
+
+logger = logging.getLogger(__name__)
+
+
+def build_automaton(words):
+    """
+    Compile (word, status) pairs into an Aho-Corasick automaton, None if there is nothing to match.
+    A word listed more than once keeps its most severe status.
+    """
+    automaton = ahocorasick.Automaton()
+
+    for word, status in words:
+        word = word.casefold()
+
+        if word in automaton:
+            status = max(status, automaton.get(word)[1])
+
+        automaton.add_word(word, (word, status))
+
+    if not len(automaton):
+        return None
+
+    automaton.make_automaton()
+    return automaton
+
+
+class ModerationFilter(object):
+    """
+    Scans outgoing messages for banned words in one pass over the text, only raw matches are checked in Python.
+    The automaton is built once per worker and rebuilt in the background when banned words change.
+    """
+
+    def __init__(self):
+        self.automaton = None
+        self.loaded = False
+        self.stale = True
+        self._loading = None
+
+    @staticmethod
+    def load():
+        return build_automaton(BannedWord.objects.values_list('word', 'status').iterator())
+
+    async def ready(self):
+        """
+        Wait for the first build, returns right away afterwards.
+        """
+        if self.loaded:
+            return
+
+        if self._loading is None or self._loading.done():
+            self.reload()
+
+        await self._loading
+
+    def reload(self, message=None):
+        """
+        Schedule a rebuild of the automaton and return its future, the pub/sub listener doesn't wait for it.
+        Reload requests arriving during a build are coalesced into one more build.
+        """
+        self.stale = True
+
+        if self._loading is None or self._loading.done():
+            self._loading = asyncio.ensure_future(self._load())
+
+        return self._loading
+
+    async def _load(self):
+        while self.stale:
+            self.stale = False
+
+            try:
+                self.automaton = await database_sync_to_async(self.load)()
+                self.loaded = True
+            except Exception:
+                logger.exception('Unable to load banned words')
+                return
+
+    def scan(self, message):
+        """
+        Return the most severe status and the banned words found in the message, (None, []) if it is clean.
+        Matches inside longer words are ignored.
+        """
+        automaton = self.automaton
+
+        if automaton is None or not isinstance(message, str):
+            return None, []
+
+        text = message.casefold()
+        status = None
+        words = []
+
+        for end, (word, word_status) in automaton.iter(text):
+            start = end - len(word) + 1
+
+            if (start > 0 and text[start - 1].isalnum()) or (end + 1 < len(text) and text[end + 1].isalnum()):
+                continue
+
+            words.append(word)
+            status = word_status if status is None else max(status, word_status)
+
+        return status, words
+
+
+moderation = ModerationFilter()
+bus.register(settings.MODERATION_RELOAD_CHANNEL, moderation.reload)
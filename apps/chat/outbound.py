@@ -0,0 +1,108 @@
+import asyncio
+from collections import deque
+
+POLICY_DROP_OLDEST = 'drop-oldest'
+POLICY_DISCONNECT = 'disconnect'
+
+
+class OutboundStats(object):
+    """
+    Per-process counters shared by all outbound queues.
+    """
+
+    def __init__(self):
+        self.queues = set()
+        self.dropped = 0
+        self.disconnected = 0
+
+    def depths(self):
+        # also called from the /metrics/ view thread, iterate a copy of the set the event loop changes
+        return [len(queue) for queue in list(self.queues)]
+
+    def to_dict(self):
+        depths = self.depths()
+        return {
+            'queues': len(depths),
+            'depth_total': sum(depths),
+            'depth_max': max(depths, default=0),
+            'dropped': self.dropped,
+            'disconnected': self.disconnected,
+        }
+
+
+outbound_stats = OutboundStats()
+
+
+class OutboundQueue(object):
+    """
+    Bounded queue of outgoing frames for a single connection, drained by its own writer task.
+    Event handlers only enqueue, so a slow client never delays other consumers on the worker.
+
+    Policies applied when the client falls behind:
+        drop-oldest - drop the oldest frame when the queue is full;
+        disconnect  - close the connection when the oldest frame waited longer than `max_lag` seconds.
+
+    There is no coalescing policy: presence diffs are incremental and chat messages unique,
+    so no queued frame can be replaced by a newer one without losing information.
+    """
+
+    def __init__(self, send, close, max_size, policy=POLICY_DROP_OLDEST, max_lag=None):
+        self.send = send
+        self.close = close
+        self.max_size = max_size
+        self.policy = policy
+        self.max_lag = max_lag
+        self.frames = deque()
+        self.closed = False
+        self.task = None
+        self._ready = asyncio.Event()
+
+    def __len__(self):
+        return len(self.frames)
+
+    def start(self):
+        outbound_stats.queues.add(self)
+        self.task = asyncio.ensure_future(self._write())
+
+    def stop(self):
+        self.closed = True
+        outbound_stats.queues.discard(self)
+
+        if self.task is not None:
+            self.task.cancel()
+
+    def put(self, frame):
+        """
+        Enqueue text or binary frame. Never blocks.
+        """
+        if self.closed:
+            return
+
+        loop = asyncio.get_event_loop()
+
+        if self.policy == POLICY_DISCONNECT and self.frames and loop.time() - self.frames[0][1] > self.max_lag:
+            outbound_stats.disconnected += 1
+            self.stop()
+            asyncio.ensure_future(self.close())
+            return
+
+        if len(self.frames) >= self.max_size:
+            self.frames.popleft()
+            outbound_stats.dropped += 1
+
+        self.frames.append((frame, loop.time()))
+        self._ready.set()
+
+    async def _write(self):
+        while True:
+            if not self.frames:
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+
+            frame = self.frames.popleft()[0]
+
+            if isinstance(frame, bytes):
+                await self.send(bytes_data=frame)
+            else:
+                await self.send(text_data=frame)
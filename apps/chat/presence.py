@@ -0,0 +1,233 @@
+import asyncio
+import logging
+import time
+from collections import Counter
+
+from django.conf import settings
+
+from apps.chat.fanout import broadcast
+from apps.chat.protocol import encode_frame
+from apps.chat.sharding import room_redis
+from apps.chat.utils import redis_sync_to_async
+
+logger = logging.getLogger(__name__)
+
+
+class PresenceStore(object):
+    """
+    Online users of every room, kept in a sorted set scored by the last heartbeat time.
+    """
+    key = 'room-presence:{}'
+
+    def touch(self, members):
+        """
+        Refresh heartbeat of (room, username) pairs, one round trip per redis node.
+        """
+        now = time.time()
+        usernames = {}
+
+        for room, username in members:
+            usernames.setdefault(room, []).append(username)
+
+        for client, rooms in room_redis.group_by_client(usernames):
+            pipe = client.pipeline(transaction=False)
+
+            for room in rooms:
+                for username in usernames[room]:
+                    pipe.zadd(self.key.format(room), now, username)
+
+                pipe.expire(self.key.format(room), settings.PRESENCE_TIMEOUT * 2)
+
+            pipe.execute()
+
+    def remove(self, rooms, username):
+        for client, node_rooms in room_redis.group_by_client(rooms):
+            pipe = client.pipeline(transaction=False)
+
+            for room in node_rooms:
+                pipe.zrem(self.key.format(room), username)
+
+            pipe.execute()
+
+    def online(self, room):
+        return room_redis.for_room(room).zrangebyscore(
+            self.key.format(room), time.time() - settings.PRESENCE_TIMEOUT, '+inf'
+        )
+
+    def expire(self, room):
+        """
+        Remove users without heartbeat. Returns removed users and the room size.
+        Only users actually removed by this call are returned, so every worker reports each user once.
+        """
+        key = self.key.format(room)
+        client = room_redis.for_room(room)
+        stale = client.zrangebyscore(key, '-inf', time.time() - settings.PRESENCE_TIMEOUT)
+        pipe = client.pipeline(transaction=False)
+
+        for username in stale:
+            pipe.zrem(key, username)
+
+        pipe.zcard(key)
+        result = pipe.execute()
+        return [username for username, removed in zip(stale, result) if removed], result[-1]
+
+
+class PresenceAggregator(object):
+    """
+    Collects joins and leaves per room and broadcasts them as one diff per aggregation window.
+    Window grows with the room size, see PRESENCE_WINDOWS.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.members = {}
+        self.pending = {}
+        self.sizes = {}
+        self.task = None
+        self.next_sweep = 0
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self._run())
+
+    def window(self, group_name):
+        size = self.sizes.get(group_name, 0)
+        seconds = 0
+
+        for min_size, window in settings.PRESENCE_WINDOWS:
+            if size >= min_size:
+                seconds = window
+
+        return seconds
+
+    async def join(self, rooms, username):
+        """
+        Mark user online in the rooms, heartbeats of all rooms are written in one round trip.
+        """
+        await redis_sync_to_async(self.store.touch)([(room.id, username) for room in rooms])
+
+        for room in rooms:
+            members = self.members.setdefault(room.group_name, (room.id, Counter()))[1]
+            members[username] += 1
+
+            if members[username] == 1:
+                self._record(room.id, room.group_name, username, joined=True)
+
+    async def heartbeat(self, username):
+        """
+        Refresh user heartbeat in every room the user joined on this worker.
+        """
+        members = [(room, username) for room, users in self.members.values() if username in users]
+
+        if members:
+            await redis_sync_to_async(self.store.touch)(members)
+
+    async def leave(self, rooms, username):
+        """
+        Mark user offline in the rooms unless another local connection of the user is still there.
+        """
+        offline = []
+
+        for room in rooms:
+            entry = self.members.get(room.group_name)
+
+            if entry is None:
+                continue
+
+            members = entry[1]
+            members[username] -= 1
+
+            if members[username] > 0:
+                continue
+
+            del members[username]
+
+            if not members:
+                del self.members[room.group_name]
+
+            offline.append(room.id)
+            self._record(room.id, room.group_name, username, joined=False)
+            self._forget(room.group_name)
+
+        if offline:
+            await redis_sync_to_async(self.store.remove)(offline, username)
+
+    def _record(self, room, group_name, username, joined):
+        if not settings.NOTIFY_USERS_ON_ENTER_OR_LEAVE_ROOMS:
+            return
+
+        if group_name not in self.pending:
+            self.pending[group_name] = {
+                'room': room,
+                'joined': set(),
+                'left': set(),
+                'deadline': time.time() + self.window(group_name),
+            }
+
+        diff = self.pending[group_name]
+        add, cancel = (diff['joined'], diff['left']) if joined else (diff['left'], diff['joined'])
+
+        if username in cancel:
+            cancel.discard(username)
+        else:
+            add.add(username)
+
+    def _forget(self, group_name):
+        """
+        Drop the size of a room without local members once its last diff is out, so sizes don't pile up.
+        """
+        if group_name not in self.members and group_name not in self.pending:
+            self.sizes.pop(group_name, None)
+
+    async def flush(self, now):
+        for group_name, diff in list(self.pending.items()):
+            if diff['deadline'] > now:
+                continue
+
+            del self.pending[group_name]
+            self._forget(group_name)
+
+            if diff['joined'] or diff['left']:
+                await broadcast(group_name, dict(
+                    type='chat.presence',
+                    **encode_frame({
+                        'msg_type': settings.MSG_TYPE_PRESENCE,
+                        'room': diff['room'],
+                        'joined': sorted(diff['joined']),
+                        'left': sorted(diff['left']),
+                    })
+                ))
+
+    async def sweep(self):
+        """
+        Refresh heartbeats of local members and report users whose worker went away.
+        """
+        members = [(room, username) for room, users in self.members.values() for username in users]
+
+        if members:
+            await redis_sync_to_async(self.store.touch)(members)
+
+        for group_name, (room, users) in list(self.members.items()):
+            stale, size = await redis_sync_to_async(self.store.expire)(room)
+            self.sizes[group_name] = size
+
+            for username in stale:
+                self._record(room, group_name, username, joined=False)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(1)
+            now = time.time()
+
+            try:
+                await self.flush(now)
+
+                if now >= self.next_sweep:
+                    self.next_sweep = now + settings.PRESENCE_TIMEOUT / 3
+                    await self.sweep()
+            except Exception:
+                logger.exception('Presence update failed')
+
+
+presence_store = PresenceStore()
+presence = PresenceAggregator(presence_store)
@@ -0,0 +1,63 @@
+import json
+
+import msgpack
+
+MSGPACK_SUBPROTOCOL = 'chatter.msgpack'
+
+# Wire keys of the msgpack protocol, a field is sent as its position in this tuple.
+# Clients depend on the numbers: only append new fields, never reorder or remove.
+FIELDS = (
+    'command', 'room', 'rooms', 'message', 'messages', 'msg_type', 'username', 'user', 'seq', 'last_seen_seq',
+    'created', 'uuid', 'status', 'tags', 'cursor', 'limit', 'join', 'leave', 'join_many', 'leave_many',
+    'history', 'who', 'users', 'joined', 'left', 'truncated', 'errors', 'error', 'retry_after', 'words',
+    'until', 'search', 'highlight', 'q', 'since',
+)
+KEYS = {name: index for index, name in enumerate(FIELDS)}
+
+
+def compact(value):
+    """
+    Replace known field names with their integer keys, unknown keys are sent as is.
+    """
+    if isinstance(value, dict):
+        return {KEYS.get(key, key): compact(item) for key, item in value.items()}
+
+    if isinstance(value, (list, tuple)):
+        return [compact(item) for item in value]
+
+    return value
+
+
+def expand(value):
+    """
+    Reverse of `compact`, used for frames received from msgpack clients.
+    """
+    if isinstance(value, dict):
+        return {
+            FIELDS[key] if isinstance(key, int) and 0 <= key < len(FIELDS) else key: expand(item)
+            for key, item in value.items()
+        }
+
+    if isinstance(value, list):
+        return [expand(item) for item in value]
+
+    return value
+
+
+def encode_msgpack(content):
+    return msgpack.packb(compact(content), use_bin_type=True)
+
+
+def decode_msgpack(data):
+    return expand(msgpack.unpackb(data, raw=False))
+
+
+def encode_frame(content):
+    """
+    Both encodings of a broadcast frame, done once by the sender.
+    Every recipient forwards the one its connection negotiated.
+    """
+    return {
+        'text': json.dumps(content),
+        'bytes': encode_msgpack(content),
+    }
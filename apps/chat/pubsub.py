@@ -0,0 +1,178 @@
+import asyncio
+import logging
+
+import aioredis
+from aioredis.pubsub import Receiver
+from django.conf import settings
+from redis import RedisError, StrictRedis
+
+logger = logging.getLogger(__name__)
+
+
+class PubSubBus(object):
+    """
+    Per-process redis pub/sub bus.
+    One subscriber connection per ASGI worker dispatches messages to registered handlers.
+    """
+
+    def __init__(self, host, port):
+        self.address = (host, port)
+        self.handlers = {}
+        self.connect_handlers = []
+        self.connection = None
+        self.receiver = None
+        self.task = None
+        self._redis = None
+        self._publisher = None
+        self._publisher_lock = None
+
+    @property
+    def redis(self):
+        """
+        Lazily created sync client, used for publishing from signals and management commands.
+        """
+        if self._redis is None:
+            self._redis = StrictRedis(host=self.address[0], port=self.address[1])
+        return self._redis
+
+    def publish(self, channel, message):
+        """
+        Publish message to all workers subscribed to the channel.
+        """
+        try:
+            return self.redis.publish(channel, message)
+        except RedisError:
+            logger.exception('Unable to publish to %s', channel)
+            return 0
+
+    async def publish_async(self, channel, message):
+        """
+        Publish message from the event loop without blocking it.
+        """
+        if self._publisher_lock is None:
+            self._publisher_lock = asyncio.Lock()
+
+        async with self._publisher_lock:
+            if self._publisher is None or self._publisher.closed:
+                self._publisher = await aioredis.create_redis(self.address)
+
+        return await self._publisher.publish(channel, message)
+
+    def register(self, channel, handler, encoding='utf-8'):
+        """
+        Register handler for the channel. Subscription happens when the listener starts.
+        Messages are decoded with `encoding`, handlers of binary channels pass None and get bytes.
+        """
+        self.handlers[channel] = (handler, encoding)
+
+    def on_connect(self, handler):
+        """
+        Call handler every time the listener (re)connects, messages published while it was away are lost,
+        so state mirrored through the bus has to be reloaded.
+        """
+        self.connect_handlers.append(handler)
+
+    async def subscribe(self, channel, handler, encoding='utf-8'):
+        """
+        Register handler and subscribe to the channel right away if the listener is connected.
+        """
+        self.handlers[channel] = (handler, encoding)
+
+        if self.connection is not None:
+            await self.connection.subscribe(self.receiver.channel(channel))
+
+    async def unsubscribe(self, channel):
+        self.handlers.pop(channel, None)
+
+        if self.connection is not None:
+            await self.connection.unsubscribe(channel)
+
+    def start(self):
+        """
+        Start listener task for the current process, does nothing if it is already running.
+        """
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self._listen())
+
+    async def _listen(self):
+        while True:
+            self.receiver = Receiver()
+            watchdog = None
+
+            try:
+                self.connection = await aioredis.create_redis(self.address)
+                watchdog = asyncio.ensure_future(self._watch(self.connection, self.receiver))
+
+                if self.handlers:
+                    await self.connection.subscribe(*[self.receiver.channel(name) for name in self.handlers])
+
+                for handler in self.connect_handlers:
+                    try:
+                        handler()
+                    except Exception:
+                        logger.exception('Pub/sub connect handler failed')
+
+                while await self.receiver.wait_message():
+                    received = await self.receiver.get()
+
+                    # receiver stopped by the watchdog
+                    if received is None:
+                        break
+
+                    await self._dispatch(received[0].name.decode(), received[1])
+
+                logger.warning('Pub/sub connection lost, reconnecting')
+            except (OSError, aioredis.RedisError):
+                logger.exception('Pub/sub connection lost, reconnecting')
+            finally:
+                if watchdog is not None:
+                    watchdog.cancel()
+
+                if self.connection is not None:
+                    self.connection.close()
+                    self.connection = None
+
+            await asyncio.sleep(1)
+
+    @staticmethod
+    async def _watch(connection, receiver):
+        """
+        Stop the receiver when the connection is gone, aioredis never wakes up a receiver waiting for messages.
+        Connections dropped without the server closing them are found by pinging.
+        """
+        interval = settings.PUBSUB_PING_INTERVAL
+
+        while True:
+            try:
+                await asyncio.wait_for(connection.wait_closed(), interval)
+                break
+            except asyncio.TimeoutError:
+                pass
+
+            try:
+                await asyncio.wait_for(connection.ping(), interval)
+            except (asyncio.TimeoutError, OSError, aioredis.RedisError):
+                logger.warning('Pub/sub connection does not answer pings')
+                break
+
+        receiver.stop()
+
+    async def _dispatch(self, channel, message):
+        if channel not in self.handlers:
+            return
+
+        handler, encoding = self.handlers[channel]
+
+        try:
+            if encoding is not None:
+                message = message.decode(encoding)
+
+            result = handler(message)
+
+            if asyncio.iscoroutine(result):
+                await result
+        except Exception:
+            logger.exception('Pub/sub handler for %s failed', channel)
+
+
+bus = PubSubBus(settings.REDIS_CHAT_URL_HOST, settings.REDIS_CHAT_URL_PORT)
@@ -0,0 +1,155 @@
+import asyncio
+import json
+import logging
+import time
+
+from django.conf import settings
+from redis import StrictRedis
+
+from apps.chat.pubsub import bus
+from apps.chat.utils import redis_sync_to_async
+from apps.repositories.interface import REDIS_API_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+MUTE = 'mute'
+BAN = 'ban'
+
+
+class Sanctions(object):
+    """
+    Room mutes and bans of users.
+    Redis holds every sanction in a sorted set scored by its expiry time (permanent ones by +inf), so expired
+    ones are removed by score without scanning. Each worker keeps a copy in a dict updated through pub/sub,
+    so checks on the send and join paths are a single lookup. The copy is loaded once and again only after
+    the pub/sub connection was lost, expired entries are dropped when they are looked up.
+    """
+    key = 'chat-sanctions:expiry'
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.redis = StrictRedis(**REDIS_API_SETTINGS)
+        self.entries = {}
+        self.loaded = False
+        self.stale = True
+        self.version = 0
+        self._pending = None
+        self._loading = None
+
+    @staticmethod
+    def field(kind, room, user_id):
+        return '{}:{}:{}'.format(kind, room, user_id)
+
+    def add(self, kind, room, user_id, duration=None):
+        """
+        Mute or ban the user in the room for `duration` seconds, forever if not given.
+        Returns expiry timestamp, 0 for permanent sanctions.
+        """
+        field = self.field(kind, room, user_id)
+        now = time.time()
+        expires = now + duration if duration else 0
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.zadd(self.key, expires or float('inf'), field)
+        pipe.zremrangebyscore(self.key, '-inf', now)
+        pipe.execute()
+        self.apply(field, expires)
+        bus.publish(self.channel, json.dumps([field, expires]))
+        return expires
+
+    def remove(self, kind, room, user_id):
+        field = self.field(kind, room, user_id)
+        self.redis.zrem(self.key, field)
+        self.apply(field, None)
+        bus.publish(self.channel, json.dumps([field, None]))
+
+    def load(self):
+        """
+        Read active sanctions from redis, expired ones are deleted on the way.
+        """
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.zremrangebyscore(self.key, '-inf', time.time())
+        pipe.zrange(self.key, 0, -1, withscores=True)
+        _, rows = pipe.execute()
+        return {field: 0 if expires == float('inf') else expires for field, expires in rows}
+
+    def update(self, message):
+        """
+        Pub/sub handler, applies a sanction added or removed by any process.
+        """
+        field, expires = json.loads(message)
+
+        if self._pending is not None:
+            self._pending.append((field, expires))
+
+        self.apply(field, expires)
+
+    def apply(self, field, expires):
+        if expires is None:
+            self.entries.pop(field, None)
+        else:
+            self.entries[field] = expires
+
+    def resync(self):
+        """
+        Pub/sub connect handler, updates published while the bus was disconnected are missing from the copy.
+        """
+        self.version += 1
+        self.stale = True
+
+    async def ready(self):
+        """
+        Wait for the first load of the sanctions, reloads after a reconnect run in the background.
+        """
+        if self.loaded and not self.stale:
+            return
+
+        if self._loading is None or self._loading.done():
+            self._loading = asyncio.ensure_future(self._load())
+
+        if not self.loaded:
+            await self._loading
+
+    async def _load(self):
+        # updates arriving while the snapshot is read are applied on top of it
+        self._pending = []
+        version = self.version
+
+        try:
+            entries = await redis_sync_to_async(self.load)()
+        except Exception:
+            logger.exception('Unable to load sanctions')
+            return
+        finally:
+            pending, self._pending = self._pending, None
+
+        self.entries = entries
+
+        for field, expires in pending:
+            self.apply(field, expires)
+
+        self.loaded = True
+
+        # a resync during the load asks for a snapshot taken after the reconnect
+        if version == self.version:
+            self.stale = False
+
+    def get(self, kind, room, user_id):
+        """
+        Expiry timestamp of an active sanction, 0 if it is permanent, None if there is none.
+        """
+        field = self.field(kind, room, user_id)
+        expires = self.entries.get(field)
+
+        if expires is None:
+            return None
+
+        if expires and expires < time.time():
+            del self.entries[field]
+            return None
+
+        return expires
+
+
+sanctions = Sanctions(settings.SANCTIONS_CHANNEL)
+bus.register(settings.SANCTIONS_CHANNEL, sanctions.update)
+bus.on_connect(sanctions.resync)
@@ -0,0 +1,78 @@
+import hashlib
+import json
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+from apps.chat.cache import STAFF_ROOMS_KEY, search_cache
+from apps.chat.models import Room
+
+
+def load_staff_rooms():
+    """
+    Ids of staff only rooms.
+    """
+    return [str(pk) for pk in Room.objects.filter(staff_only=True).values_list('pk', flat=True)]
+
+
+def build_query(user, data, staff_rooms):
+    """
+    Repository arguments and cache key of validated search parameters.
+    Users other than staff never see messages of staff only rooms.
+    """
+    query = {
+        'text': ' '.join(data['q'].split()).lower(),
+        'rooms': sorted({str(room) for room in data.get('rooms') or []}) or None,
+        'user': data.get('user'),
+        'since': data['since'].isoformat() if data.get('since') else None,
+        'until': data['until'].isoformat() if data.get('until') else None,
+        'tags': sorted({tag.lower() for tag in data.get('tags') or []}) or None,
+        'limit': data['limit'],
+        'cursor': data.get('cursor'),
+    }
+    key = json.dumps(dict(query, staff=user.is_staff), sort_keys=True)
+    query['exclude_rooms'] = None if user.is_staff else staff_rooms
+    return key, query
+
+
+def search_messages(elastic, user, data):
+    """
+    Search messages the user can access with the sync repository.
+    Called from request threads, so results are kept in the thread safe django cache.
+    """
+    key, query = build_query(user, data, None if user.is_staff else load_staff_rooms())
+    key = 'message-search:{}'.format(hashlib.md5(key.encode()).hexdigest())
+    result = cache.get(key)
+
+    if result is None:
+        result = elastic.search_messages(**query)
+        cache.set(key, result, settings.SEARCH_CACHE_TIMEOUT)
+
+    return result
+
+
+async def search_messages_async(elastic, user, data):
+    """
+    Search messages the user can access with the async repository.
+    Called from the event loop only, results and staff rooms are kept in the per-process search cache.
+    """
+    staff_rooms = None
+
+    if not user.is_staff:
+        staff_rooms = search_cache.get(STAFF_ROOMS_KEY)
+
+        if staff_rooms is None:
+            generation = search_cache.generation
+            staff_rooms = await database_sync_to_async(load_staff_rooms)()
+            search_cache.set(STAFF_ROOMS_KEY, staff_rooms, generation)
+
+    key, query = build_query(user, data, staff_rooms)
+    result = search_cache.get(key)
+
+    if result is None:
+        generation = search_cache.generation
+        result = await elastic.search_messages(**query)
+        search_cache.set(key, result, generation)
+
+    return result
@@ -0,0 +1,63 @@
+import json
+
+from dateutil.parser import isoparse
+from django.conf import settings
+from django.utils.translation import ugettext as _
+from rest_framework import serializers
+
+
+class HistoryCursorSerializer(serializers.Serializer):
+    """
+    `created` and `uuid` of the oldest message the client has.
+    """
+    created = serializers.CharField(max_length=50)
+    uuid = serializers.UUIDField()
+
+    def validate_created(self, value):
+        try:
+            isoparse(value)
+        except ValueError:
+            raise serializers.ValidationError(_('Invalid date.'))
+
+        return value
+
+    def validate(self, attrs):
+        return dict(attrs, uuid=str(attrs['uuid']))
+
+
+class HistorySerializer(serializers.Serializer):
+    """
+    Serializer for the parameters of the websocket history command, pages larger than HISTORY_PAGE_SIZE are cut.
+    """
+    limit = serializers.IntegerField(min_value=1, required=False, allow_null=True)
+    cursor = HistoryCursorSerializer(required=False, allow_null=True)
+
+    def validate_limit(self, value):
+        return min(value or settings.HISTORY_PAGE_SIZE, settings.HISTORY_PAGE_SIZE)
+
+
+class MessageSearchSerializer(serializers.Serializer):
+    """
+    Serializer for message search parameters, shared by the REST endpoint and the websocket command.
+    """
+    q = serializers.CharField(max_length=200, required=False, allow_blank=True, default='')
+    rooms = serializers.ListField(child=serializers.UUIDField(), required=False)
+    user = serializers.CharField(max_length=150, required=False)
+    since = serializers.DateTimeField(required=False)
+    until = serializers.DateTimeField(required=False)
+    tags = serializers.ListField(child=serializers.CharField(max_length=50), required=False)
+    limit = serializers.IntegerField(
+        min_value=1, max_value=settings.SEARCH_PAGE_SIZE, required=False, default=settings.SEARCH_PAGE_SIZE
+    )
+    cursor = serializers.CharField(required=False)
+
+    def validate_cursor(self, value):
+        try:
+            cursor = json.loads(value)
+        except ValueError:
+            cursor = None
+
+        if not isinstance(cursor, list):
+            raise serializers.ValidationError(_('Invalid cursor.'))
+
+        return cursor
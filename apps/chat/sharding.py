@@ -0,0 +1,103 @@
+import bisect
+import hashlib
+
+from channels_redis.core import RedisChannelLayer
+from django.conf import settings
+from redis import StrictRedis
+
+
+def parse_node(node):
+    """
+    Split `host:port` into host and port.
+    """
+    host, _, port = node.rpartition(':')
+    return host, int(port)
+
+
+class HashRing(object):
+    """
+    Consistent hash ring. Adding a node moves only about 1/n of the keys.
+    """
+
+    def __init__(self, nodes, replicas=160):
+        self.nodes = list(nodes)
+        self.ring = sorted(
+            (self.hash('{}-{}'.format(node, replica).encode()), index)
+            for index, node in enumerate(self.nodes)
+            for replica in range(replicas)
+        )
+        self.hashes = [point for point, _ in self.ring]
+
+    @staticmethod
+    def hash(value):
+        return int(hashlib.md5(value).hexdigest()[:16], 16)
+
+    def get_index(self, key):
+        if isinstance(key, str):
+            key = key.encode('utf8')
+
+        position = bisect.bisect(self.hashes, self.hash(key)) % len(self.ring)
+        return self.ring[position][1]
+
+    def get_node(self, key):
+        return self.nodes[self.get_index(key)]
+
+
+class ShardedRedisChannelLayer(RedisChannelLayer):
+    """
+    Channel layer that places groups and channels on redis hosts with a consistent hash ring
+    instead of the default modulo split, so adding hosts doesn't reshuffle every group.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.ring = HashRing([self.node_name(host) for host in self.hosts])
+
+    @staticmethod
+    def node_name(host):
+        address = host['address']
+
+        if isinstance(address, (list, tuple)):
+            return '{}:{}'.format(*address)
+
+        return str(address)
+
+    def consistent_hash(self, value):
+        return self.ring.get_index(value)
+
+
+class RoomRedis(object):
+    """
+    Redis clients for per-room chat state, every room lives on one node of the ring.
+    Keys of the same room always share a node, so scripts touching several of them keep working.
+    """
+
+    def __init__(self, nodes, **options):
+        self.ring = HashRing(nodes)
+        self.clients = {}
+
+        for node in nodes:
+            host, port = parse_node(node)
+            self.clients[node] = StrictRedis(host=host, port=port, **options)
+
+    def for_room(self, room):
+        return self.clients[self.ring.get_node(str(room))]
+
+    def group_by_client(self, rooms):
+        """
+        Group rooms by the client that holds them, used to build one pipeline per node.
+        """
+        groups = {}
+
+        for room in rooms:
+            groups.setdefault(self.for_room(room), []).append(room)
+
+        return groups.items()
+
+
+room_redis = RoomRedis(
+    settings.REDIS_CHAT_NODES,
+    db=settings.REDIS_CHAT_URL_DB,
+    charset=settings.REDIS_CHAT_CHARSET,
+    decode_responses=settings.REDIS_CHAT_DECODE_RESPONSES,
+)
@@ -0,0 +1,114 @@
+import json
+import zlib
+
+from django.conf import settings
+from redis import ResponseError, StrictRedis
+
+from apps.repositories.interface import REDIS_API_SETTINGS
+
+
+class MessageStream(object):
+    """
+    Durable chat log in redis streams, sharded by room.
+    Workers append messages, indexer processes read them through a consumer group
+    and acknowledge entries only after they were saved to elasticsearch.
+    """
+    key = 'chat-messages:{}'
+
+    def __init__(self, shards, group, maxlen):
+        self.shards = shards
+        self.group = group
+        self.maxlen = maxlen
+        self.redis = StrictRedis(**REDIS_API_SETTINGS)
+
+    def shard_key(self, room):
+        return self.key.format(zlib.crc32(str(room).encode()) % self.shards)
+
+    def append(self, rows):
+        """
+        XADD every row to the stream of its shard, all rows in one round trip.
+        """
+        pipe = self.redis.pipeline(transaction=False)
+
+        for row in rows:
+            pipe.execute_command(
+                'XADD', self.shard_key(row['room']), 'MAXLEN', '~', self.maxlen, '*', 'message', json.dumps(row)
+            )
+
+        pipe.execute()
+
+    def ensure_group(self, keys):
+        for key in keys:
+            try:
+                self.redis.execute_command('XGROUP', 'CREATE', key, self.group, '0', 'MKSTREAM')
+            except ResponseError as e:
+                if 'BUSYGROUP' not in str(e):
+                    raise
+
+    def read(self, consumer, keys, count, block=None, pending=False):
+        """
+        Read entries for the consumer. With `pending` returns entries delivered earlier but not acknowledged.
+        Returns list of (stream key, entry id, row), row is None for pending entries already trimmed from the stream.
+        """
+        command = ['XREADGROUP', 'GROUP', self.group, consumer, 'COUNT', count]
+
+        if block is not None and not pending:
+            command += ['BLOCK', block]
+
+        command += ['STREAMS'] + list(keys) + ['0' if pending else '>'] * len(keys)
+        response = self.redis.execute_command(*command) or []
+
+        return [
+            (key, entry_id, json.loads(dict(zip(fields[::2], fields[1::2]))['message']) if fields else None)
+            for key, entries in response
+            for entry_id, fields in entries
+        ]
+
+    def claim(self, consumer, keys, min_idle, count):
+        """
+        Take over entries other consumers got more than `min_idle` milliseconds ago and never acknowledged,
+        left behind by indexers which crashed or were started under another name.
+        Returns entries like `read`, they stay pending for the new consumer until acknowledged.
+        """
+        claimed = []
+
+        for key in keys:
+            pending = self.redis.execute_command('XPENDING', key, self.group, '-', '+', count)
+            ids = [
+                entry_id for entry_id, owner, idle, _ in pending or []
+                if owner != consumer and idle >= min_idle
+            ]
+
+            if not ids:
+                continue
+
+            entries = self.redis.execute_command('XCLAIM', key, self.group, consumer, min_idle, *ids) or []
+            claimed += [
+                (key, entry[0], json.loads(dict(zip(entry[1][::2], entry[1][1::2]))['message']) if entry[1] else None)
+                for entry in entries if entry
+            ]
+
+        return claimed
+
+    def ack(self, entries):
+        """
+        Acknowledge (stream key, entry id) pairs.
+        """
+        ids = {}
+
+        for key, entry_id in entries:
+            ids.setdefault(key, []).append(entry_id)
+
+        pipe = self.redis.pipeline(transaction=False)
+
+        for key, entry_ids in ids.items():
+            pipe.execute_command('XACK', key, self.group, *entry_ids)
+
+        pipe.execute()
+
+
+message_stream = MessageStream(
+    settings.MESSAGE_STREAM_SHARDS,
+    settings.MESSAGE_STREAM_GROUP,
+    settings.MESSAGE_STREAM_MAXLEN,
+)
@@ -1,14 +1,15 @@
 import json
 
+from celery.exceptions import MaxRetriesExceededError
 from django.contrib.auth import get_user_model
-from elasticsearch.helpers import bulk
-from elasticsearch_dsl.connections import connections
 from elasticsearch_dsl.query import Q
 
+from apps.chat.indexer import BulkIndexer, dead_letters
 from apps.chat.message import Message
-from apps.repositories.search import MessageIndex
 from chatter.celery import app as celery_app
 
+indexer = None
+
 
 class MessageSaver(object):
     """
@@ -16,12 +17,21 @@ class MessageSaver(object):
     """
 
     @staticmethod
-    @celery_app.task(name='apps.chat.save_message')
-    def save_message(rows):
+    @celery_app.task(name='apps.chat.save_message', bind=True, max_retries=5, default_retry_delay=10)
+    def save_message(task, rows):
         """
         Save message to the elasticsearch.
+        Rows which failed for a transient reason are retried by a new task, then go to the dead letters.
         """
-        MessageIndex.init()
-        msg = [MessageIndex(**row).to_dict(include_meta=True) for row in rows]
-        es = connections.get_connection()
-        bulk(es, msg)
+        global indexer
+
+        if indexer is None:
+            indexer = BulkIndexer()
+
+        retry = [rows[index] for index in indexer.index(rows)]
+
+        if retry:
+            try:
+                raise task.retry(args=(retry,))
+            except MaxRetriesExceededError:
+                dead_letters.push([(row, 'retries exceeded') for row in retry])
@@ -1,3 +1,357 @@
-from django.test import TestCase
+import asyncio
+import json
+import time
+import uuid
 
-# Create your tests here.
+import msgpack
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from rest_framework_jwt.settings import api_settings
+
+from apps.chat.cache import CachedRoom, LRUCache
+from apps.chat.exceptions import ClientError
+from apps.chat.loadtest import CommunicatorClient
+from apps.chat.middleware import TOKEN_SUBPROTOCOL
+from apps.chat.models import Room
+from apps.chat.moderation import ModerationFilter, build_automaton
+from apps.chat.presence import PresenceAggregator
+from apps.chat.protocol import KEYS, MSGPACK_SUBPROTOCOL, decode_msgpack, encode_frame, encode_msgpack
+from apps.chat.pubsub import PubSubBus
+from apps.chat.sanctions import BAN, MUTE, Sanctions
+from apps.chat.serializers import HistorySerializer
+from apps.chat.throttling import send_throttle
+from apps.chat.utils import normalize_uuid
+from chatter.routing import application
+
+User = get_user_model()
+
+jwt_payload_handler = api_settings.JWT_PAYLOAD_HANDLER
+jwt_encode_handler = api_settings.JWT_ENCODE_HANDLER
+
+
+def run(coroutine):
+    return asyncio.get_event_loop().run_until_complete(coroutine)
+
+
+async def wait_for_condition(condition, timeout=5, action=None):
+    """
+    Poll until `condition()` is true, running `action()` before every check.
+    """
+    loop = asyncio.get_event_loop()
+    deadline = loop.time() + timeout
+
+    while loop.time() < deadline:
+        if action is not None:
+            action()
+
+        if condition():
+            return True
+
+        await asyncio.sleep(0.1)
+
+    return False
+
+
+class LRUCacheTests(SimpleTestCase):
+
+    def test_least_recently_used_is_evicted(self):
+        cache = LRUCache(2, 60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_expired_value_is_missing(self):
+        cache = LRUCache(2, -1)
+        cache.set('a', 1)
+        self.assertIsNone(cache.get('a'))
+
+    def test_set_after_invalidation_is_skipped(self):
+        cache = LRUCache(2, 60)
+        generation = cache.generation
+        cache.invalidate('a')
+        cache.set('a', 'stale', generation)
+        self.assertIsNone(cache.get('a'))
+
+        cache.set('a', 'fresh', cache.generation)
+        self.assertEqual(cache.get('a'), 'fresh')
+
+    def test_room_uuid_is_normalized(self):
+        room_uuid = uuid.uuid4()
+        self.assertEqual(normalize_uuid(room_uuid.hex.upper()), str(room_uuid))
+
+        with self.assertRaises(ClientError):
+            normalize_uuid('not-a-room')
+
+
+class HistorySerializerTests(SimpleTestCase):
+
+    def test_limit_defaults_and_is_cut_to_page_size(self):
+        page_size = settings.HISTORY_PAGE_SIZE
+
+        for limit, expected in ((None, page_size), (page_size + 1, page_size), (1, 1)):
+            serializer = HistorySerializer(data={'limit': limit})
+            self.assertTrue(serializer.is_valid())
+            self.assertEqual(serializer.validated_data['limit'], expected)
+
+    def test_invalid_limit_is_rejected(self):
+        for limit in ('abc', 0, [1]):
+            self.assertFalse(HistorySerializer(data={'limit': limit}).is_valid())
+
+    def test_cursor_shape_is_checked(self):
+        message_uuid = str(uuid.uuid4())
+        valid = HistorySerializer(data={'cursor': {'created': '2018-03-01T10:00:00+00:00', 'uuid': message_uuid}})
+        self.assertTrue(valid.is_valid())
+        self.assertEqual(valid.validated_data['cursor']['uuid'], message_uuid)
+
+        for cursor in ({'created': '2018-03-01T10:00:00+00:00'}, {'created': 'yesterday', 'uuid': message_uuid}, 'abc'):
+            self.assertFalse(HistorySerializer(data={'cursor': cursor}).is_valid())
+
+
+class ProtocolTests(SimpleTestCase):
+    frame = {
+        'msg_type': settings.MSG_TYPE_MESSAGE,
+        'room': 'room',
+        'messages': [{'username': 'chatter', 'message': 'hello', 'seq': 1}],
+        'extra': None,
+    }
+
+    def test_msgpack_round_trip(self):
+        self.assertEqual(decode_msgpack(encode_msgpack(self.frame)), self.frame)
+
+    def test_known_fields_are_sent_as_integer_keys(self):
+        packed = msgpack.unpackb(encode_msgpack(self.frame), raw=False)
+        self.assertEqual(packed[KEYS['room']], 'room')
+        self.assertEqual(packed[KEYS['messages']][0][KEYS['username']], 'chatter')
+        self.assertIn('extra', packed)
+
+    def test_broadcast_frame_has_both_encodings(self):
+        frame = encode_frame(self.frame)
+        self.assertEqual(json.loads(frame['text']), self.frame)
+        self.assertEqual(decode_msgpack(frame['bytes']), self.frame)
+
+
+class ModerationFilterTests(SimpleTestCase):
+
+    def setUp(self):
+        self.moderation = ModerationFilter()
+        self.moderation.automaton = build_automaton([
+            ('spam', settings.MSG_TYPE_WARNING),
+            ('buy now', settings.MSG_TYPE_MUTED),
+            ('SPAM', settings.MSG_TYPE_MUTED),
+        ])
+
+    def test_whole_words_are_matched_case_insensitively(self):
+        self.assertEqual(self.moderation.scan('No Spam, please'), (settings.MSG_TYPE_MUTED, ['spam']))
+        self.assertEqual(self.moderation.scan('Buy now!'), (settings.MSG_TYPE_MUTED, ['buy now']))
+
+    def test_matches_inside_words_are_ignored(self):
+        self.assertEqual(self.moderation.scan('spammer antispam'), (None, []))
+
+    def test_clean_message_and_empty_list(self):
+        self.assertEqual(self.moderation.scan('hello'), (None, []))
+        self.assertIsNone(build_automaton([]))
+
+
+class FakePresenceStore(object):
+
+    def touch(self, members):
+        pass
+
+    def remove(self, rooms, username):
+        pass
+
+
+@override_settings(NOTIFY_USERS_ON_ENTER_OR_LEAVE_ROOMS=True)
+class PresenceAggregatorTests(SimpleTestCase):
+
+    def setUp(self):
+        self.presence = PresenceAggregator(FakePresenceStore())
+        self.room = CachedRoom('room', False, 'room-room')
+
+    def test_user_is_offline_after_last_connection_leaves(self):
+        run(self.presence.join([self.room], 'chatter'))
+        run(self.presence.join([self.room], 'chatter'))
+        run(self.presence.leave([self.room], 'chatter'))
+        self.assertIn(self.room.group_name, self.presence.members)
+
+        run(self.presence.leave([self.room], 'chatter'))
+        self.assertNotIn(self.room.group_name, self.presence.members)
+
+    def test_size_of_empty_room_is_dropped_on_flush(self):
+        run(self.presence.join([self.room], 'chatter'))
+        self.presence.sizes[self.room.group_name] = 1
+        # the join and the leave cancel out, so the flush broadcasts nothing
+        run(self.presence.leave([self.room], 'chatter'))
+        run(self.presence.flush(float('inf')))
+        self.assertEqual(self.presence.sizes, {})
+
+
+@override_settings(SEND_RATE_USER=0.01, SEND_BURST_USER=3, SEND_RATE_ROOM=0.01, SEND_BURST_ROOM=5)
+class SendThrottleTests(SimpleTestCase):
+    """
+    Needs the redis server of the settings.
+    """
+
+    def setUp(self):
+        self.room = str(uuid.uuid4())
+
+    def test_lease_is_limited_by_the_user_burst(self):
+        user_id = str(uuid.uuid4())
+        self.assertEqual(send_throttle.acquire(user_id, self.room, 10)[0], 3)
+
+        granted, retry_after = send_throttle.acquire(user_id, self.room, 10)
+        self.assertEqual(granted, 0)
+        self.assertGreater(retry_after, 0)
+
+    def test_room_bucket_is_shared_by_users(self):
+        self.assertEqual(send_throttle.acquire(str(uuid.uuid4()), self.room, 10)[0], 3)
+        self.assertEqual(send_throttle.acquire(str(uuid.uuid4()), self.room, 10)[0], 2)
+        self.assertEqual(send_throttle.acquire(str(uuid.uuid4()), self.room, 10)[0], 0)
+
+
+class SanctionsTests(SimpleTestCase):
+
+    def setUp(self):
+        self.sanctions = Sanctions('chat:test-sanctions')
+        self.sanctions.key = 'chat-sanctions:test-{}'.format(uuid.uuid4())
+
+    def test_expired_sanction_is_dropped_on_lookup(self):
+        now = time.time()
+        self.sanctions.apply(Sanctions.field(MUTE, 'room', 1), now - 1)
+        self.sanctions.apply(Sanctions.field(MUTE, 'room', 2), now + 60)
+        self.sanctions.apply(Sanctions.field(BAN, 'room', 1), 0)
+
+        self.assertIsNone(self.sanctions.get(MUTE, 'room', 1))
+        self.assertNotIn(Sanctions.field(MUTE, 'room', 1), self.sanctions.entries)
+        self.assertEqual(self.sanctions.get(MUTE, 'room', 2), now + 60)
+        self.assertEqual(self.sanctions.get(BAN, 'room', 1), 0)
+
+    def test_load_skips_and_deletes_expired(self):
+        """
+        Needs the redis server of the settings.
+        """
+        now = time.time()
+        self.sanctions.redis.zadd(self.sanctions.key, now - 1, Sanctions.field(MUTE, 'room', 1))
+        self.sanctions.redis.zadd(self.sanctions.key, now + 60, Sanctions.field(MUTE, 'room', 2))
+        self.sanctions.redis.zadd(self.sanctions.key, float('inf'), Sanctions.field(BAN, 'room', 1))
+        self.addCleanup(self.sanctions.redis.delete, self.sanctions.key)
+
+        self.assertEqual(self.sanctions.load(), {
+            Sanctions.field(MUTE, 'room', 2): now + 60,
+            Sanctions.field(BAN, 'room', 1): 0,
+        })
+        self.assertEqual(self.sanctions.redis.zcard(self.sanctions.key), 2)
+
+    def test_copy_is_reloaded_only_after_resync(self):
+        """
+        Needs the redis server of the settings.
+        """
+        run(self.sanctions.ready())
+        self.assertTrue(self.sanctions.loaded)
+        self.assertFalse(self.sanctions.stale)
+
+        self.sanctions.resync()
+        self.assertTrue(self.sanctions.stale)
+        run(self.sanctions.ready())
+        run(self.sanctions._loading)
+        self.assertFalse(self.sanctions.stale)
+
+
+class PubSubBusTests(SimpleTestCase):
+    """
+    Needs the redis server of the settings.
+    """
+    channel = 'chat:test-pubsub'
+
+    def setUp(self):
+        self.bus = PubSubBus(settings.REDIS_CHAT_URL_HOST, settings.REDIS_CHAT_URL_PORT)
+        self.received = []
+        self.bus.register(self.channel, self.received.append)
+
+    def tearDown(self):
+        self.bus.task.cancel()
+
+    def test_publish_is_delivered_after_connection_is_killed(self):
+        async def scenario():
+            self.bus.start()
+            self.assertTrue(await wait_for_condition(
+                lambda: self.received, action=lambda: self.bus.publish(self.channel, 'before')
+            ))
+
+            self.bus.redis.execute_command('CLIENT', 'KILL', 'TYPE', 'pubsub')
+            self.received.clear()
+
+            self.assertTrue(await wait_for_condition(
+                lambda: 'after' in self.received, action=lambda: self.bus.publish(self.channel, 'after')
+            ))
+
+        run(scenario())
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class ChatConsumerTests(TransactionTestCase):
+    """
+    Drives ChatConsumer through the whole ASGI application, middleware and routing included.
+    Joining and sending need the redis server of the settings.
+    """
+
+    def setUp(self):
+        # created without signals, like the load test users
+        User.objects.bulk_create([User(username='chatter', email='chatter@test.local', is_active=True)])
+        self.token = jwt_encode_handler(jwt_payload_handler(User.objects.get(username='chatter')))
+        self.room = str(Room.objects.create().pk)
+
+    def test_connect_with_query_string_token(self):
+        client = CommunicatorClient(application, self.token)
+        self.assertTrue(run(client.connect()))
+        run(client.close())
+
+    def test_connect_without_token_is_rejected(self):
+        communicator = WebsocketCommunicator(application, '/chat/')
+        connected, _ = run(communicator.connect())
+        self.assertFalse(connected)
+
+    def test_connect_with_token_subprotocol(self):
+        communicator = WebsocketCommunicator(application, '/chat/', subprotocols=[TOKEN_SUBPROTOCOL, self.token])
+        connected, subprotocol = run(communicator.connect())
+        self.assertTrue(connected)
+        self.assertEqual(subprotocol, TOKEN_SUBPROTOCOL)
+        run(communicator.disconnect())
+
+    def test_connect_with_msgpack_subprotocol(self):
+        client = CommunicatorClient(application, self.token, subprotocols=[MSGPACK_SUBPROTOCOL])
+        connected, subprotocol = run(client.communicator.connect())
+        self.assertTrue(connected)
+        self.assertEqual(subprotocol, MSGPACK_SUBPROTOCOL)
+        run(client.close())
+
+    def test_sent_message_is_broadcast(self):
+        client = CommunicatorClient(application, self.token)
+        self.assertTrue(run(client.connect()))
+
+        run(client.send({'command': 'join', 'room': self.room}))
+        self.assertEqual(run(client.receive())['join'], self.room)
+
+        run(client.send({'command': 'send', 'room': self.room, 'message': 'hello'}))
+        frame = run(self.receive_message(client))
+        self.assertEqual(frame['room'], self.room)
+        self.assertEqual(frame['username'], 'chatter')
+        self.assertEqual(frame['message'], 'hello')
+        run(client.close())
+
+    async def receive_message(self, client):
+        """
+        Skip presence frames until the chat message arrives.
+        """
+        while True:
+            frame = await asyncio.wait_for(client.receive(), 5)
+
+            if frame.get('msg_type') == settings.MSG_TYPE_MESSAGE or 'error' in frame:
+                return frame
@@ -0,0 +1,76 @@
+import time
+
+from django.conf import settings
+from redis import StrictRedis
+
+from apps.repositories.interface import REDIS_API_SETTINGS
+
+# Token buckets of the user and of the room refilled and charged together in one atomic call.
+# Grants up to ARGV[2] tokens (a lease the worker spends locally), or 0 and seconds until the next token.
+ACQUIRE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local requested = tonumber(ARGV[2])
+local tokens = {}
+
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[1 + i * 2])
+    local burst = tonumber(ARGV[2 + i * 2])
+    local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+    local available = tonumber(bucket[1]) or burst
+    local ts = tonumber(bucket[2]) or now
+    tokens[i] = math.min(burst, available + math.max(0, now - ts) * rate)
+end
+
+local granted = math.floor(math.min(requested, unpack(tokens)))
+local retry_after = 0
+
+if granted < 1 then
+    granted = 0
+
+    for i, available in ipairs(tokens) do
+        retry_after = math.max(retry_after, (1 - available) / tonumber(ARGV[1 + i * 2]))
+    end
+end
+
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[1 + i * 2])
+    local burst = tonumber(ARGV[2 + i * 2])
+    redis.call('HMSET', key, 'tokens', tokens[i] - granted, 'ts', now)
+    redis.call('EXPIRE', key, math.ceil(burst / rate) + 1)
+end
+
+return {granted, tostring(retry_after)}
+"""
+
+
+class SendThrottle(object):
+    """
+    Per-user and per-room token buckets for the send command, stored in redis.
+    """
+    user_key = 'send-rate-user:{}'
+    room_key = 'send-rate-room:{}'
+
+    def __init__(self):
+        self.redis = StrictRedis(**REDIS_API_SETTINGS)
+        self.script = self.redis.register_script(ACQUIRE_SCRIPT)
+
+    def acquire(self, user_id, room, requested):
+        """
+        Take up to `requested` tokens from both buckets.
+        Returns granted tokens and seconds to wait when nothing was granted.
+        """
+        granted, retry_after = self.script(
+            keys=[self.user_key.format(user_id), self.room_key.format(room)],
+            args=[
+                time.time(),
+                requested,
+                settings.SEND_RATE_USER,
+                settings.SEND_BURST_USER,
+                settings.SEND_RATE_ROOM,
+                settings.SEND_BURST_ROOM,
+            ]
+        )
+        return int(granted), float(retry_after)
+
+
+send_throttle = SendThrottle()
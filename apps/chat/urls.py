@@ -0,0 +1,8 @@
+from django.urls import path
+
+from apps.chat.views import MessageSearchView
+
+app_name = 'chat'
+urlpatterns = [
+    path('search/', MessageSearchView.as_view()),
+]
@@ -1,23 +1,135 @@
+import asyncio
+import functools
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
 from channels.db import database_sync_to_async
+from django.conf import settings
 
+from apps.chat.cache import CachedRoom, room_cache
 from apps.chat.exceptions import ClientError
+from apps.chat.metrics import room_lookup_seconds
 from apps.chat.models import Room
 
+redis_executor = ThreadPoolExecutor(max_workers=settings.REDIS_EXECUTOR_WORKERS)
 
-@database_sync_to_async
-def get_room_or_error(room_uuid, user):
+
+def redis_sync_to_async(func):
     """
-    Check user auth, permissions and room existence.
+    Run blocking redis call in a dedicated thread pool, so it doesn't compete with database calls.
     """
-    if not user.is_authenticated:
-        raise ClientError('USER_HAS_TO_LOGIN')
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(redis_executor, functools.partial(func, *args, **kwargs))
+
+    return wrapper
+
+
+def normalize_uuid(room_uuid):
+    """
+    Canonical form of a room uuid, the one invalidations are published with.
+    """
+    try:
+        return str(uuid.UUID(str(room_uuid)))
+    except ValueError:
+        raise ClientError('ROOM_INVALID')
+
 
+@database_sync_to_async
+def get_room(room_uuid):
+    """
+    Load room metadata from the database.
+    """
     try:
         room = Room.objects.get(pk=room_uuid)
     except Room.DoesNotExist:
         raise ClientError('ROOM_INVALID')
 
-    if room.staff_only and not user.is_staff:
-        raise ClientError('ROOM_ACCESS_DENIED')
-    
-    return room
+    return CachedRoom(str(room.id), room.staff_only, room.group_name)
+
+
+async def get_room_or_error(room_uuid, user):
+    """
+    Check user auth, permissions and room existence.
+    Room metadata is served from the per-process cache when possible.
+    """
+    start = time.perf_counter()
+
+    try:
+        if not user.is_authenticated:
+            raise ClientError('USER_HAS_TO_LOGIN')
+
+        room_uuid = normalize_uuid(room_uuid)
+        room = room_cache.get(room_uuid)
+
+        if room is None:
+            generation = room_cache.generation
+            room = await get_room(room_uuid)
+            room_cache.set(room_uuid, room, generation)
+
+        if room.staff_only and not user.is_staff:
+            raise ClientError('ROOM_ACCESS_DENIED')
+
+        return room
+    finally:
+        room_lookup_seconds.observe(time.perf_counter() - start)
+
+
+@database_sync_to_async
+def get_rooms(room_uuids):
+    """
+    Load metadata of many rooms with a single query.
+    """
+    return {
+        str(room.id): CachedRoom(str(room.id), room.staff_only, room.group_name)
+        for room in Room.objects.filter(pk__in=room_uuids)
+    }
+
+
+async def get_rooms_or_error(room_uuids, user):
+    """
+    Bulk version of get_room_or_error.
+    Returns rooms available for the user and error codes of the rest, both keyed by the given uuids.
+    """
+    if not user.is_authenticated:
+        raise ClientError('USER_HAS_TO_LOGIN')
+
+    rooms = {}
+    errors = {}
+    missing = {}
+
+    for room_uuid in map(str, room_uuids):
+        try:
+            pk = normalize_uuid(room_uuid)
+        except ClientError as e:
+            errors[room_uuid] = e.code
+            continue
+
+        room = room_cache.get(pk)
+
+        if room is None:
+            missing[room_uuid] = pk
+        else:
+            rooms[room_uuid] = room
+
+    if missing:
+        generation = room_cache.generation
+        found = await get_rooms(list(missing.values()))
+
+        for room_uuid, pk in missing.items():
+            room = found.get(pk)
+
+            if room is None:
+                errors[room_uuid] = 'ROOM_INVALID'
+            else:
+                room_cache.set(pk, room, generation)
+                rooms[room_uuid] = room
+
+    for room_uuid, room in list(rooms.items()):
+        if room.staff_only and not user.is_staff:
+            del rooms[room_uuid]
+            errors[room_uuid] = 'ROOM_ACCESS_DENIED'
+
+    return rooms, errors
@@ -1,3 +1,35 @@
-from django.shortcuts import render
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+from rest_framework.response import Response
+from rest_framework.views import APIView
 
-# Create your views here.
+from apps.chat.search import search_messages
+from apps.chat.serializers import MessageSearchSerializer
+from apps.repositories.elasticsearch_interface import ElasticInterface
+
+elastic = ElasticInterface()
+
+
+def metrics(request):
+    """
+    Chat metrics of this process in the Prometheus text format.
+    Served by daphne next to the websocket consumers, so every worker has to be scraped.
+    """
+    if settings.METRICS_ALLOWED_IPS and request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        return HttpResponseForbidden()
+
+    return HttpResponse(generate_latest(REGISTRY), content_type=CONTENT_TYPE_LATEST)
+
+
+class MessageSearchView(APIView):
+    """
+    get:
+        Search messages in the rooms available for the user.
+        Filter by rooms, user, since/until dates and tags, pass `cursor` of the response to get the next page.
+    """
+
+    def get(self, request):
+        serializer = MessageSearchSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return Response(search_messages(elastic, request.user, serializer.validated_data))
@@ -1,5 +1,110 @@
+import asyncio
+import calendar
+import json
+
+from dateutil.parser import isoparse
+from django.conf import settings
+from elasticsearch_async import AsyncElasticsearch
+from elasticsearch_dsl import Q
+
+from apps.chat.buffer import message_buffer
 from apps.chat.message import Message
-from apps.repositories.interface import ElasticInterfaceBase
+from apps.repositories.interface import ELASTICSEARCH_API_SETTINGS, AsyncElasticInterfaceBase, ElasticInterfaceBase
+from apps.repositories.search import INDEX_ALIAS, MessageIndex
+
+
+def to_timestamp(created):
+    """
+    Convert stored iso date to epoch milliseconds, the value elasticsearch sorts dates by.
+    """
+    date = isoparse(created)
+    return calendar.timegm(date.timetuple()) * 1000 + date.microsecond // 1000
+
+
+def history_search(search, room, limit, cursor=None):
+    """
+    Page of room history, newest first.
+    Cursor is the `created` and `uuid` of the oldest message client already has,
+    pages are fetched with search_after so deep pages cost the same as the first one.
+    The query goes to the room shard only and its sort matches the index sort, so it stops after `limit` hits.
+    """
+    search = search.filter('term', room=room).sort('room', '-created', '-uuid').extra(track_total_hits=False)
+
+    if cursor is not None:
+        search = search.extra(search_after=[room, to_timestamp(cursor['created']), cursor['uuid']])
+
+    return search[:limit]
+
+
+def replay_search(search, room, seq, limit, until=None):
+    """
+    Messages of the room with sequence number in (seq, until), oldest first.
+    """
+    search = search.filter('term', room=room).filter('range', seq={'gt': seq})
+
+    if until is not None:
+        search = search.filter('range', seq={'lt': until})
+
+    return search.sort('seq')[:limit]
+
+
+def message_search(search, text, rooms=None, exclude_rooms=None, user=None, since=None, until=None, tags=None,
+                   limit=20, cursor=None):
+    """
+    Full-text search over messages, best matches first, newest first without text.
+    Everything except the text goes to the filter context, which elasticsearch caches between requests.
+    Cursor is the sort values of the last hit of the previous page.
+    """
+    filters = []
+
+    if rooms:
+        filters.append(Q('terms', room=rooms))
+
+    if user:
+        filters.append(Q('term', **{'user.raw': user}))
+
+    if since or until:
+        filters.append(Q('range', created={key: value for key, value in (('gte', since), ('lt', until)) if value}))
+
+    if tags:
+        filters.append(Q('terms', tags=tags))
+
+    search = search.query(Q(
+        'bool',
+        must=[Q('match', message={'query': text, 'operator': 'and'})] if text else [],
+        filter=filters,
+        must_not=[Q('terms', room=exclude_rooms)] if exclude_rooms else [],
+    ))
+
+    if text:
+        search = search.sort('_score', '-created', '-uuid').highlight(
+            'message', fragment_size=150, number_of_fragments=1
+        )
+    else:
+        search = search.sort('-created', '-uuid')
+
+    if cursor is not None:
+        search = search.extra(search_after=cursor)
+
+    return search.extra(track_total_hits=False)[:limit]
+
+
+def search_results(hits, limit):
+    """
+    Messages with highlighted snippets and the cursor of the next page, None on the last one.
+    """
+    messages = []
+
+    for hit in hits:
+        message = dict(hit['_source'])
+
+        if 'highlight' in hit:
+            message['highlight'] = hit['highlight']['message']
+
+        messages.append(message)
+
+    cursor = json.dumps(hits[-1]['sort']) if len(hits) == limit else None
+    return {'messages': messages, 'cursor': cursor}
 
 
 class ElasticInterface(ElasticInterfaceBase):
@@ -7,23 +112,134 @@ class ElasticInterface(ElasticInterfaceBase):
     Implementation of elasticsearch interface.
     """
 
-    def append_message(self, room, user, created, message, status, tags):
+    def append_message(self, room, user, created, message, status, tags, uuid=None, seq=None):
+        """
+        Save message to the elasticsearch index.
+        Messages go through the write-behind buffer and are saved in batches.
+        """
+        msg = Message(
+            room=room,
+            user=user,
+            created=created,
+            message=message,
+            status=status,
+            tags=tags,
+            uuid=uuid,
+            seq=seq
+        )
+        message_buffer.append(msg.to_document())
+
+    def get_messages(self, room, limit, cursor=None):
+        """
+        Get messages from elastic for selected room, oldest first.
+        """
+        room = str(room)
+        search = history_search(self.search.params(routing=room), room, limit, cursor)
+        return [hit.to_dict() for hit in reversed(search.execute().hits)]
+
+    def get_messages_since(self, room, seq, limit, until=None):
+        """
+        Get messages of selected room with sequence number in (seq, until), oldest first.
+        Used to replay the gap which already left the redis log.
+        """
+        room = str(room)
+        search = replay_search(self.search.params(routing=room), room, seq, limit, until)
+        return [hit.to_dict() for hit in search]
+
+    def search_messages(self, limit, rooms=None, **query):
+        """
+        Full-text search, see `message_search`. Only shards of the given rooms are searched.
+        """
+        search = message_search(self.search, rooms=rooms, limit=limit, **query)
+
+        if rooms:
+            search = search.params(routing=','.join(rooms))
+
+        return search_results(search.execute().to_dict()['hits']['hits'], limit)
+
+
+class AsyncElasticInterface(AsyncElasticInterfaceBase):
+    """
+    Implementation of elasticsearch interface for the event loop.
+    Requests share the pooled connections of one client per worker, at most ELASTICSEARCH_ASYNC_CONCURRENCY
+    run at once and each one, waiting for a free slot included, is cancelled after ELASTICSEARCH_ASYNC_TIMEOUT.
+    Consumers await it directly, nothing is handed to the thread pools used by database and redis calls.
+    """
+
+    def __init__(self):
+        self.search = MessageIndex.search()
+        self._es = None
+        self._slots = None
+        self._loop = None
+
+    @property
+    def es(self):
+        """
+        Client and concurrency limit are created in the running loop on first use.
+        """
+        loop = asyncio.get_event_loop()
+
+        if self._loop is not loop:
+            self._loop = loop
+            self._es = AsyncElasticsearch(
+                ELASTICSEARCH_API_SETTINGS['hosts'], loop=loop, maxsize=settings.ELASTICSEARCH_ASYNC_CONNECTIONS
+            )
+            self._slots = asyncio.Semaphore(settings.ELASTICSEARCH_ASYNC_CONCURRENCY)
+
+        return self._es
+
+    async def execute(self, search, routing=None):
+        """
+        Run the search, returns raw hits.
+        Raises asyncio.TimeoutError or ElasticsearchException if elasticsearch is slow or unavailable.
+        """
+        return await asyncio.wait_for(self._execute(search, routing), settings.ELASTICSEARCH_ASYNC_TIMEOUT)
+
+    async def _execute(self, search, routing):
+        es = self.es
+
+        async with self._slots:
+            response = await es.search(index=INDEX_ALIAS, body=search.to_dict(), routing=routing)
+
+        return response['hits']['hits']
+
+    async def append_message(self, room, user, created, message, status, tags, uuid=None, seq=None):
         """
         Save message to the elasticsearch index.
+        Messages go through the write-behind buffer, so nothing is awaited here.
         """
-        msg = [Message(
+        msg = Message(
             room=room,
             user=user,
             created=created,
             message=message,
             status=status,
-            tags=tags
-        )]
-        print(msg)
-        # MessageSaver.save_message.delay(msg)
+            tags=tags,
+            uuid=uuid,
+            seq=seq
+        )
+        message_buffer.append(msg.to_document())
+
+    async def get_messages(self, room, limit, cursor=None):
+        """
+        Get messages from elastic for selected room, oldest first.
+        """
+        room = str(room)
+        hits = await self.execute(history_search(self.search, room, limit, cursor), room)
+        return [hit['_source'] for hit in reversed(hits)]
+
+    async def get_messages_since(self, room, seq, limit, until=None):
+        """
+        Get messages of selected room with sequence number in (seq, until), oldest first.
+        """
+        room = str(room)
+        hits = await self.execute(replay_search(self.search, room, seq, limit, until), room)
+        return [hit['_source'] for hit in hits]
 
-    def get_messages(self, room, limit):
+    async def search_messages(self, limit, rooms=None, **query):
         """
-        Get messages from elastic for selected room.
+        Full-text search, see `message_search`. Only shards of the given rooms are searched.
         """
-        pass
+        search = message_search(self.search, rooms=rooms, limit=limit, **query)
+        hits = await self.execute(search, ','.join(rooms) if rooms else None)
+        return search_results(hits, limit)
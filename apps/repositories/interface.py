@@ -2,9 +2,10 @@ import abc
 
 from django.conf import settings
 from elasticsearch import Elasticsearch
-from elasticsearch_dsl import Search
 from redis import StrictRedis
 
+from apps.repositories.search import MessageIndex
+
 REDIS_API_SETTINGS = {
     'host': settings.REDIS_CHAT_URL_HOST,
     'port': settings.REDIS_CHAT_URL_PORT,
@@ -25,7 +26,10 @@ class RedisInterfaceBase(abc.ABC):
     def __init__(self, *args, **kwargs):
         self.redis = StrictRedis(**REDIS_API_SETTINGS)
 
-    def append_message(self, room, user, created, message, status, tags):
+    def append_message(self, room, user, created, message, status, tags, uuid=None):
+        """
+        Save message to the room log, returns message sequence number in the room.
+        """
         raise NotImplementedError
 
     def get_messages(self, room, limit):
@@ -38,16 +42,46 @@ class ElasticInterfaceBase(abc.ABC):
     """
     def __init__(self, *args, **kwargs):
         self.es = Elasticsearch(**ELASTICSEARCH_API_SETTINGS)
-        self.search = Search(using=self.es, index='Messages')
+        self.search = MessageIndex.search(using=self.es)
 
-    def append_message(self, room, user, created, message, status, tags):
+    def append_message(self, room, user, created, message, status, tags, uuid=None, seq=None):
         """
         Save message to the elasticsearch index.
         """
         raise NotImplementedError
 
-    def get_messages(self, room, limit):
+    def get_messages(self, room, limit, cursor=None):
+        """
+        Get messages from elastic for selected room, older than cursor.
+        """
+        raise NotImplementedError
+
+    def search_messages(self, limit, rooms=None, **query):
+        """
+        Full-text search over messages.
+        """
+        raise NotImplementedError
+
+
+class AsyncElasticInterfaceBase(abc.ABC):
+    """
+    Base interface for elasticsearch used from the event loop.
+    """
+
+    async def append_message(self, room, user, created, message, status, tags, uuid=None, seq=None):
+        """
+        Save message to the elasticsearch index.
+        """
+        raise NotImplementedError
+
+    async def get_messages(self, room, limit, cursor=None):
+        """
+        Get messages from elastic for selected room, older than cursor.
+        """
+        raise NotImplementedError
+
+    async def search_messages(self, limit, rooms=None, **query):
         """
-        Get messages from elastic for selected room.
+        Full-text search over messages.
         """
         raise NotImplementedError
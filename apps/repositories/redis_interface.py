@@ -0,0 +1,82 @@
+import json
+
+from django.conf import settings
+
+from apps.chat.message import Message
+from apps.chat.sharding import room_redis
+from apps.repositories.interface import RedisInterfaceBase
+
+# Assign the next room sequence number and push the message with it in a single atomic call.
+# Message is passed as a json object without `seq`, the number is spliced in front of its fields.
+APPEND_MESSAGE_SCRIPT = """
+local seq = redis.call('INCR', KEYS[2])
+redis.call('LPUSH', KEYS[1], '{"seq": ' .. seq .. ', ' .. string.sub(ARGV[1], 2))
+redis.call('LTRIM', KEYS[1], 0, tonumber(ARGV[2]) - 1)
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return seq
+"""
+
+
+class RedisInterface(RedisInterfaceBase):
+    """
+    Implementation of redis interface.
+    Keeps the last REDIS_MESSAGES_LIMIT messages of every room in a capped list,
+    every message gets a monotonically increasing per-room sequence number.
+    Room keys are spread over REDIS_CHAT_NODES by consistent hashing.
+    """
+    key = 'room-messages:{}'
+    seq_key = 'room-seq:{}'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.append_script = self.redis.register_script(APPEND_MESSAGE_SCRIPT)
+
+    def append_message(self, room, user, created, message, status, tags, uuid=None):
+        """
+        Push message to the head of the room list, trim it and refresh TTL in one round trip.
+        Returns sequence number of the message.
+        """
+        msg = Message(
+            room=room,
+            user=user,
+            created=created,
+            message=message,
+            status=status,
+            tags=tags,
+            uuid=uuid
+        )
+        document = msg.to_document()
+        del document['seq']
+        return self.append_script(
+            keys=[self.key.format(room), self.seq_key.format(room)],
+            args=[json.dumps(document), settings.REDIS_MESSAGES_LIMIT, settings.REDIS_MESSAGES_TIMEOUT],
+            client=room_redis.for_room(room)
+        )
+
+    def get_messages(self, room, limit):
+        """
+        Get last messages for selected room, oldest first.
+        """
+        rows = room_redis.for_room(room).lrange(self.key.format(room), 0, limit - 1)
+        return [json.loads(row) for row in reversed(rows)]
+
+    def get_messages_since(self, room, seq):
+        """
+        Get messages of selected room newer than `seq`, oldest first.
+        Second value tells if the log covers the whole gap, otherwise the older part has to be read from elastic.
+        Third is the last sequence number given out in the room.
+        """
+        pipe = room_redis.for_room(room).pipeline(transaction=False)
+        pipe.lrange(self.key.format(room), 0, -1)
+        pipe.get(self.seq_key.format(room))
+        rows, last_seq = pipe.execute()
+
+        messages = [message for message in map(json.loads, reversed(rows)) if message.get('seq', 0) > seq]
+        last_seq = int(last_seq or 0)
+
+        if messages:
+            complete = messages[0]['seq'] == seq + 1
+        else:
+            complete = last_seq <= seq
+
+        return messages, complete, last_seq
@@ -1,18 +1,70 @@
-from elasticsearch_dsl import DocType, Nested, field
+from django.conf import settings
+from elasticsearch_dsl import DocType, field
+from elasticsearch_dsl.analysis import normalizer
+
+# Messages are stored in monthly indices `message-YYYY-MM` created from a template on first write.
+# Every monthly index joins the `message` alias used for reads, dropping a month is a single index delete.
+INDEX_ALIAS = 'message'
+INDEX_PATTERN = 'message-*'
+INDEX_NAME = 'message-{}'
+
+# Documents of a room live on one shard and are kept sorted by (room, created, uuid) on disk,
+# so room history sorted the same way is read from one shard and stops after `limit` hits.
+INDEX_SORT = {
+    'sort.field': ['room', 'created', 'uuid'],
+    'sort.order': ['asc', 'desc', 'desc'],
+}
+
+# tags are filtered case-insensitively, search lowercases the requested ones as well
+lowercase_tag = normalizer('lowercase_tag', filter=['lowercase'])
 
 
 class MessageIndex(DocType):
     room = field.Keyword()
-    user = field.Text()
+    user = field.Text(fields={'raw': field.Keyword()})
     created = field.Date()
     message = field.Text()
-    status = field.Text()
-    tags = Nested(
-        properties=
-        {
-            'tags': field.Text()
-        }
-    )
+    status = field.Keyword()
+    uuid = field.Keyword()
+    seq = field.Long()
+    # a flat keyword array, elasticsearch refuses index sorting on indices with nested fields
+    tags = field.Keyword(normalizer=lowercase_tag)
 
     class Meta:
-        index = 'Message'
+        index = INDEX_ALIAS
+
+    @staticmethod
+    def index_for(created):
+        """
+        Monthly index of a message, `created` is an iso date.
+        """
+        return INDEX_NAME.format(created[:7])
+
+    @classmethod
+    def to_action(cls, row):
+        """
+        Bulk action saving the message row into its monthly index, routed by room.
+        Message uuid is the id, so saving the same row again overwrites it.
+        Rows saved before messages had uuids get generated ids.
+        """
+        meta = {'index': cls.index_for(row['created']), 'routing': str(row['room'])}
+
+        if row.get('uuid'):
+            meta['id'] = row['uuid']
+
+        return cls(meta=meta, **row).to_dict(include_meta=True)
+
+    @classmethod
+    def init_template(cls, using):
+        """
+        Create or update the template of monthly indices, existing months keep their mapping.
+        """
+        mapping = cls._doc_type.mapping
+        using.indices.put_template(name=INDEX_ALIAS, body={
+            'index_patterns': [INDEX_PATTERN],
+            'settings': dict(
+                INDEX_SORT, number_of_shards=settings.MESSAGE_INDEX_SHARDS, analysis=mapping._collect_analysis()
+            ),
+            'mappings': mapping.to_dict(),
+            'aliases': {INDEX_ALIAS: {}},
+        })
@@ -6,11 +6,14 @@ from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
 
 from apps.chat.consumers import ChatConsumer
+from apps.chat.middleware import JWTAuthMiddleware
 
 application = ProtocolTypeRouter({
     'websocket': AuthMiddlewareStack(
-        URLRouter([
-            path('chat/', ChatConsumer),
-        ]),
+        JWTAuthMiddleware(
+            URLRouter([
+                path('chat/', ChatConsumer),
+            ]),
+        ),
     ),
 })
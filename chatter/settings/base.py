@@ -206,12 +206,16 @@ REST_AUTH_SERIALIZERS = {
 
 CHANNEL_REDIS_HOST = env.str('CHANNEL_REDIS_HOST', default='localhost')
 CHANNEL_REDIS_PORT = env.int('CHANNEL_REDIS_PORT', default=6379)
+# host:port list, room groups are consistently hashed across these nodes
+CHANNEL_REDIS_NODES = env.list(
+    'CHANNEL_REDIS_NODES', default=['{}:{}'.format(CHANNEL_REDIS_HOST, CHANNEL_REDIS_PORT)]
+)
 ASGI_APPLICATION = 'chatter.routing.application'
 CHANNEL_LAYERS = {
     'default': {
-        'BACKEND': 'channels_redis.core.RedisChannelLayer',
+        'BACKEND': 'apps.chat.sharding.ShardedRedisChannelLayer',
         'CONFIG': {
-            'hosts': [(CHANNEL_REDIS_HOST, CHANNEL_REDIS_PORT)],
+            'hosts': [(node.rpartition(':')[0], int(node.rpartition(':')[2])) for node in CHANNEL_REDIS_NODES],
         },
     },
 }
@@ -224,12 +228,85 @@ TWILIO_NUMBER = env.str('TWILIO_NUMBER', default='')
 
 NOTIFY_USERS_ON_ENTER_OR_LEAVE_ROOMS = True
 
+ROOM_CACHE_MAX_SIZE = env.int('ROOM_CACHE_MAX_SIZE', default=10000)
+ROOM_CACHE_TIMEOUT = env.int('ROOM_CACHE_TIMEOUT', default=60 * 5)
+ROOM_CACHE_INVALIDATION_CHANNEL = 'chat:room-invalidate'
+# seconds between pings of the pub/sub connection, a connection not answering within the same time is replaced
+PUBSUB_PING_INTERVAL = env.int('PUBSUB_PING_INTERVAL', default=30)
+# banned words are rebuilt into the moderation automaton of every worker on this channel
+MODERATION_RELOAD_CHANNEL = 'chat:moderation-reload'
+# seconds a user is muted in the room after sending a word with the MUTED status
+MODERATION_MUTE_DURATION = env.int('MODERATION_MUTE_DURATION', default=60 * 10)
+# mutes and bans added or removed anywhere are mirrored into every worker on this channel
+SANCTIONS_CHANNEL = 'chat:sanctions'
+# staff alerts for every connected user, one message per worker
+ANNOUNCEMENT_CHANNEL = 'chat:announcements'
+
+WEBSOCKET_USER_CACHE_MAX_SIZE = env.int('WEBSOCKET_USER_CACHE_MAX_SIZE', default=100000)
+WEBSOCKET_USER_CACHE_TIMEOUT = env.int('WEBSOCKET_USER_CACHE_TIMEOUT', default=60)
+
+# stream - redis streams read by `manage.py run_indexer`; celery - MessageSaver task
+MESSAGE_PERSISTENCE = env.str('MESSAGE_PERSISTENCE', default='stream')
+MESSAGE_STREAM_SHARDS = env.int('MESSAGE_STREAM_SHARDS', default=4)
+MESSAGE_STREAM_MAXLEN = env.int('MESSAGE_STREAM_MAXLEN', default=1000000)
+MESSAGE_STREAM_GROUP = 'indexer'
+INDEXER_BATCH_SIZE = env.int('INDEXER_BATCH_SIZE', default=1000)
+# documents per bulk request and bulk requests in flight per indexer, not tuned, see benchmark_indexer
+INDEXER_CHUNK_SIZE = env.int('INDEXER_CHUNK_SIZE', default=500)
+INDEXER_THREADS = env.int('INDEXER_THREADS', default=2)
+# retries of documents rejected with 429, waiting initial * 2 ** n seconds up to max
+INDEXER_MAX_RETRIES = env.int('INDEXER_MAX_RETRIES', default=5)
+INDEXER_INITIAL_BACKOFF = env.float('INDEXER_INITIAL_BACKOFF', default=1)
+INDEXER_MAX_BACKOFF = env.float('INDEXER_MAX_BACKOFF', default=60)
+# milliseconds, entries of other consumers pending longer are claimed by the running indexer
+INDEXER_CLAIM_IDLE = env.int('INDEXER_CLAIM_IDLE', default=300000)
+# primary shards of every monthly message index, see apps.repositories.search
+MESSAGE_INDEX_SHARDS = env.int('MESSAGE_INDEX_SHARDS', default=3)
+# elasticsearch client used by websocket consumers: pooled connections, requests in flight, seconds per request
+ELASTICSEARCH_ASYNC_CONNECTIONS = env.int('ELASTICSEARCH_ASYNC_CONNECTIONS', default=20)
+ELASTICSEARCH_ASYNC_CONCURRENCY = env.int('ELASTICSEARCH_ASYNC_CONCURRENCY', default=50)
+ELASTICSEARCH_ASYNC_TIMEOUT = env.float('ELASTICSEARCH_ASYNC_TIMEOUT', default=2)
+
+MESSAGE_BUFFER_FLUSH_SIZE = env.int('MESSAGE_BUFFER_FLUSH_SIZE', default=500)
+MESSAGE_BUFFER_FLUSH_INTERVAL = env.float('MESSAGE_BUFFER_FLUSH_INTERVAL', default=0.1)
+MESSAGE_BUFFER_MAX_SIZE = env.int('MESSAGE_BUFFER_MAX_SIZE', default=50000)
+
+REDIS_EXECUTOR_WORKERS = env.int('REDIS_EXECUTOR_WORKERS', default=8)
+JOIN_HISTORY_LIMIT = env.int('JOIN_HISTORY_LIMIT', default=50)
+# rooms a single join_many or leave_many command may name
+JOIN_MANY_MAX_ROOMS = env.int('JOIN_MANY_MAX_ROOMS', default=100)
+HISTORY_PAGE_SIZE = env.int('HISTORY_PAGE_SIZE', default=50)
+SEARCH_PAGE_SIZE = env.int('SEARCH_PAGE_SIZE', default=20)
+# repeated searches are answered from a per-process cache for this many seconds
+SEARCH_CACHE_MAX_SIZE = env.int('SEARCH_CACHE_MAX_SIZE', default=1000)
+SEARCH_CACHE_TIMEOUT = env.int('SEARCH_CACHE_TIMEOUT', default=30)
+REPLAY_LIMIT = env.int('REPLAY_LIMIT', default=500)
+
+# drop-oldest or disconnect, see apps.chat.outbound.OutboundQueue
+OUTBOUND_QUEUE_POLICY = env.str('OUTBOUND_QUEUE_POLICY', default='drop-oldest')
+OUTBOUND_QUEUE_SIZE = env.int('OUTBOUND_QUEUE_SIZE', default=1000)
+OUTBOUND_QUEUE_MAX_LAG = env.int('OUTBOUND_QUEUE_MAX_LAG', default=30)
+
+# layer - group_send through the channel layer, one copy per member channel;
+# local - one pub/sub message per worker, delivered to local consumers, see apps.chat.fanout
+CHAT_FANOUT = env.str('CHAT_FANOUT', default='layer')
+
+# seconds without heartbeat after which user is considered offline
+PRESENCE_TIMEOUT = env.int('PRESENCE_TIMEOUT', default=60)
+# (minimal room size, seconds) - presence diffs of bigger rooms are aggregated over longer windows
+PRESENCE_WINDOWS = (
+    (0, 1),
+    (100, 5),
+    (1000, 15),
+)
+
 MSG_TYPE_MESSAGE = 0
 MSG_TYPE_WARNING = 1 
 MSG_TYPE_ALERT = 2
 MSG_TYPE_MUTED = 3
 MSG_TYPE_ENTER = 4
 MSG_TYPE_LEAVE = 5
+MSG_TYPE_PRESENCE = 6
 
 MESSAGE_TYPES_CHOICES = (
     (MSG_TYPE_MESSAGE, 'MESSAGE'),
@@ -238,6 +315,7 @@ MESSAGE_TYPES_CHOICES = (
     (MSG_TYPE_MUTED, 'MUTED'),
     (MSG_TYPE_ENTER, 'ENTER'),
     (MSG_TYPE_LEAVE, 'LEAVE'),
+    (MSG_TYPE_PRESENCE, 'PRESENCE'),
 )
 
 MESSAGE_TYPES_LIST = [
@@ -247,4 +325,16 @@ MESSAGE_TYPES_LIST = [
     MSG_TYPE_MUTED,
     MSG_TYPE_ENTER,
     MSG_TYPE_LEAVE,
+    MSG_TYPE_PRESENCE,
 ]
+
+# token buckets for the websocket send command: messages per second and burst size
+SEND_RATE_USER = env.float('SEND_RATE_USER', default=5)
+SEND_BURST_USER = env.int('SEND_BURST_USER', default=20)
+SEND_RATE_ROOM = env.float('SEND_RATE_ROOM', default=100)
+SEND_BURST_ROOM = env.int('SEND_BURST_ROOM', default=300)
+# tokens taken from redis at once and spent locally by the connection
+SEND_RATE_LEASE = env.int('SEND_RATE_LEASE', default=3)
+
+# addresses allowed to scrape /metrics/, everyone if empty
+METRICS_ALLOWED_IPS = env.list('METRICS_ALLOWED_IPS', default=[])
@@ -107,9 +107,14 @@ EMAIL_TEMPLATE_DEFAULTS['BASE_URL'] = SITE_URL
 EMAIL_TEMPLATE_DEFAULTS['FROM_EMAIL'] = EMAIL_HOST_USER
 
 REDIS_MESSAGES_TIMEOUT = 60 * 60
+REDIS_MESSAGES_LIMIT = env.int('REDIS_MESSAGES_LIMIT', default=200)
 REDIS_CHAT_URL_HOST = env.str('REDIS_CHAT_URL_HOST', default='localhost')
 REDIS_CHAT_URL_PORT = env.int('REDIS_CHAT_URL_PORT', default=6379)
 REDIS_CHAT_URL_DB = env.int('REDIS_CHAT_URL_DB', default=0)
 REDIS_CHAT_CHARSET = env.str('REDIS_CHAT_URL_DB', default='utf-8')
 REDIS_CHAT_DECODE_RESPONSES = env.bool('REDIS_CHAT_DECODE_RESPONSES', default=True)
+# host:port list, per-room chat state is consistently hashed across these nodes
+REDIS_CHAT_NODES = env.list(
+    'REDIS_CHAT_NODES', default=['{}:{}'.format(REDIS_CHAT_URL_HOST, REDIS_CHAT_URL_PORT)]
+)
 ELASTICSEARCH_CHAT_HOST = env.str('ELASTICSEARCH_CHAT_HOST', default='localhost:9200')
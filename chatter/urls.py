@@ -5,6 +5,8 @@ from django.contrib import admin
 from django.contrib.auth.views import password_reset_confirm, password_reset_complete
 from django.urls import include, path
 
+from apps.chat.views import metrics
+
 ENVIRONMENT_TYPE = env.str('ENVIRONMENT_TYPE', default='development')
 
 api_urlpatterns = [
@@ -12,6 +14,7 @@ api_urlpatterns = [
     path('user/', include('rest_auth.urls')),
     path('location/', include('apps.location.urls')),
     path('phone/', include('apps.phone.urls')),
+    path('chat/', include('apps.chat.urls')),
 ]
 
 urlpatterns = [
@@ -21,6 +24,7 @@ urlpatterns = [
     ),
     path('password/reset/done/', password_reset_complete, name='password_reset_complete'),
     path('admin/', admin.site.urls),
+    path('metrics/', metrics),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 
 if ENVIRONMENT_TYPE == 'development':